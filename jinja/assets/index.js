@@ -0,0 +1,135 @@
+function openItems(evt, item) {
+    var i;
+    var x = document.getElementsByClassName("items");
+    var nav_items = document.getElementsByClassName("nav-item");
+    for (i = 0; i < x.length; i++) {
+      x[i].style.display = "none";
+    }
+    for (i = 0; i < x.length; i++) {
+        nav_items[i].className = nav_items[i].className.replace(" active", "");
+    }
+    document.getElementById(item).style.display = "flex";
+    evt.currentTarget.className += " active";
+}
+
+// search index: manifest, documents, facets and title shards are fetched on demand
+var searchIndex = {base: null, manifest: null, docs: null, facets: null, shards: {}};
+
+function fetchJSON(url) {
+    return fetch(url).then(function (response) { return response.json(); });
+}
+
+function loadSearchIndex() {
+    if (searchIndex.manifest) {
+        return Promise.resolve(searchIndex);
+    }
+    var manifest_url = document.querySelector("form.search").dataset.index;
+    searchIndex.base = manifest_url.substring(0, manifest_url.lastIndexOf("/") + 1);
+    return fetchJSON(manifest_url).then(function (manifest) {
+        searchIndex.manifest = manifest;
+        return Promise.all([fetchJSON(searchIndex.base + manifest.docs), fetchJSON(searchIndex.base + manifest.facets)]);
+    }).then(function (files) {
+        searchIndex.docs = files[0];
+        searchIndex.facets = files[1];
+        fillFacet("search-genre", searchIndex.facets.genres);
+        fillFacet("search-language", searchIndex.facets.languages);
+        return searchIndex;
+    });
+}
+
+function fillFacet(id, postings) {
+    var select = document.getElementById(id);
+    Object.keys(postings).forEach(function (value) {
+        var option = document.createElement("option");
+        option.value = value;
+        option.text = value + " (" + postings[value].length + ")";
+        select.appendChild(option);
+    });
+}
+
+function tokenize(text) {
+    return text.normalize("NFKD").replace(/[\u0300-\u036f]/g, "").toLowerCase().split(/[^0-9a-z]+/).filter(Boolean);
+}
+
+function titleIds(token) {
+    var key = token.substring(0, searchIndex.manifest.shard_length);
+    var file = searchIndex.manifest.shards[key];
+    if (!file) {
+        return Promise.resolve(new Set());
+    }
+    var shard = searchIndex.shards[key] || fetchJSON(searchIndex.base + file);
+    searchIndex.shards[key] = shard;
+    return Promise.resolve(shard).then(function (postings) {
+        searchIndex.shards[key] = postings;
+        var ids = new Set();
+        Object.keys(postings).forEach(function (indexed) {
+            if (indexed.indexOf(token) === 0) {
+                postings[indexed].forEach(function (id) { ids.add(id); });
+            }
+        });
+        return ids;
+    });
+}
+
+function intersect(sets) {
+    return sets.reduce(function (result, ids) {
+        return new Set(Array.from(result).filter(function (id) { return ids.has(id); }));
+    });
+}
+
+function element(tag, className, text) {
+    var node = document.createElement(tag);
+    if (className) {
+        node.className = className;
+    }
+    if (text !== undefined) {
+        node.textContent = text;
+    }
+    return node;
+}
+
+// results come from documents of the whole category, not from items of this page
+function showResults(ids) {
+    var results = document.getElementById("search-results");
+    results.textContent = "";
+    searchIndex.docs.forEach(function (doc) {
+        if (!ids.has(doc[0])) {
+            return;
+        }
+        var item = element("div", "item");
+        item.dataset.id = doc[0];
+        var link = element("a");
+        link.href = "http://www.imdb.com/title/tt" + doc[0] + "/";
+        link.target = "_blank";
+        var cover = element("img");
+        cover.src = doc[4] || "";
+        cover.alt = doc[1];
+        link.appendChild(cover);
+        item.appendChild(link);
+        item.appendChild(element("h3", null, doc[1]));
+        item.appendChild(element("h4", null, doc[2] + " - " + doc[3] + "/10"));
+        results.appendChild(item);
+    });
+}
+
+function searchItems() {
+    var tokens = tokenize(document.getElementById("search-title").value);
+    var genre = document.getElementById("search-genre").value;
+    var language = document.getElementById("search-language").value;
+    loadSearchIndex().then(function () {
+        return Promise.all(tokens.map(titleIds));
+    }).then(function (sets) {
+        if (genre) {
+            sets.push(new Set(searchIndex.facets.genres[genre] || []));
+        }
+        if (language) {
+            sets.push(new Set(searchIndex.facets.languages[language] || []));
+        }
+        var ids = sets.length ? intersect(sets) : null;
+        if (ids) {
+            showResults(ids);
+        }
+        document.body.classList.toggle("searching", !!ids);
+        document.getElementById("search-count").textContent = ids ? ids.size + " / " + searchIndex.manifest.count : "";
+    });
+}
@@ -1,5 +1,4 @@
 import logging
-import logging.config
 import mtpublishers.tools.config as cfg
 
 logger = logging.getLogger(__name__)
@@ -15,4 +14,4 @@ logging.getLogger(__name__).addHandler(logging.NullHandler())
 # Configuration
 #
 
-config = cfg.populate_config(cfg.init_config(), reload_=False)
+config = cfg.LazyConfig(reload_=False)
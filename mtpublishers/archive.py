@@ -0,0 +1,141 @@
+import os
+import shutil
+import datetime
+import logging
+import jinja2
+from mtpublishers.core import Publisher
+from mtpublishers.website import jinja_environment
+from mtpublishers import config
+import mtpublishers.tools.files as files_tools
+import mtpublishers.tools.assets as assets_tools
+from mtpublishers.tools.history import ArchiveStore
+from mtpublishers.tools.profiling import tracer
+
+logger = logging.getLogger(__name__)
+
+# score and valid_date change with every data: archiving them would store
+# every item each time
+ARCHIVE_FIELDS = ('title', 'imdb_id', 'rating', 'year', 'cover_url', 'genres', 'language_codes')
+
+
+class ArchivePublisher(Publisher):
+    """Archive each published data in [directory] archive
+
+    Data is appended to an ArchiveStore, only items changed since the
+    previous snapshot are stored. Then the dated page of this snapshot and
+    the archive index are rendered: older pages are never rendered again.
+
+    The store is internal state, it is kept out of the published
+    directories: [archive] store, default archive.store next to [hash] file.
+    """
+
+    def __init__(self, jinja_env: jinja2.Environment = None):
+        super().__init__()
+        self._jinja_env = jinja_env if jinja_env else jinja_environment()
+        self._date_format = config.get('archive', 'date_format', fallback='%Y-%m-%d')
+        self._store = None
+
+    @staticmethod
+    def archive_dir() -> str:
+        return config.get('directory', 'archive')
+
+    @staticmethod
+    def store_file() -> str:
+        store_file = config.get('archive', 'store', fallback='')
+        if store_file:
+            return store_file
+        hash_file = config.get('hash', 'file', fallback='')
+        if not hash_file:
+            raise ValueError("No archive store: set [archive] store or [hash] file")
+        return os.path.join(os.path.dirname(os.path.abspath(hash_file)), 'archive.store')
+
+    def move_published_store(self, store_file: str):
+        """Move a store left in the archive directory by previous versions"""
+        published = os.path.join(self.archive_dir(), 'archive.store')
+        if os.path.abspath(published) == os.path.abspath(store_file) or not os.path.exists(published) \
+                or os.path.exists(store_file):
+            return
+        logger.warning("archive store moved out of published directory: %s -> %s" % (published, store_file))
+        os.makedirs(os.path.dirname(os.path.abspath(store_file)), exist_ok=True)
+        for suffix in ('', '.checkpoint'):
+            if os.path.exists(published + suffix):
+                shutil.move(published + suffix, store_file + suffix)
+
+    @property
+    def store(self) -> ArchiveStore:
+        store_file = self.store_file()
+        if self._store is None or self._store.path != store_file:
+            self.move_published_store(store_file)
+            self._store = ArchiveStore(store_file, ARCHIVE_FIELDS)
+        return self._store
+
+    def snapshot_name(self) -> str:
+        return datetime.date.today().strftime(self._date_format)
+
+    def page_file(self, name: str) -> str:
+        return os.path.join(self.archive_dir(), '%s.html' % name)
+
+    def archive_categories(self) -> dict:
+        """category -> item key -> item fields, items in order
+
+        Categories which failed to load keep their archived items.
+        """
+        categories = {}
+        for cat_name in self.data.category_items:
+            if cat_name in self.data.failed_categories:
+                previous = self.store.state['categories'].get(cat_name)
+                if previous:
+                    categories[cat_name] = {key: previous['items'][key] for key in previous['order']}
+                continue
+            items = {}
+            for position, item in enumerate(self.data.category_items[cat_name].items):
+                key = item.get('imdb_id') or '#%d' % position
+                if key not in items:
+                    items[key] = tuple(item.get(f) for f in ARCHIVE_FIELDS)
+            categories[cat_name] = items
+        return categories
+
+    def publish(self):
+        try:
+            store = self.store
+            name = self.snapshot_name()
+            if store.snapshots and store.snapshots[-1]['hash'] == self.data.hash:
+                name = store.snapshots[-1]['name']
+                logger.debug("data already archived in %s" % name)
+                if os.path.exists(self.page_file(name)):
+                    return True
+            else:
+                with tracer.span('archive:append', page=name) as span:
+                    record = store.append({'name': name, 'hash': self.data.hash}, dict(self.data.informations),
+                                          self.archive_categories())
+                    span['items'] = record['snapshot']['items']
+                    span['changed'] = record['snapshot']['changed']
+            with tracer.span('archive:render', page=name):
+                self.render_page(name)
+                self.render_index()
+        except Exception as err:
+            logger.error("Error while publishing archive: %s" % str(err))
+            return False
+        return True
+
+    def render_page(self, name: str) -> bool:
+        """Render archive page of latest snapshot"""
+        template = self._jinja_env.get_template('archive.html')
+        return files_tools.write_output(self.page_file(name), template.generate({
+            'asset_url': assets_tools.asset_url_function(self.archive_dir()),
+            'name': name,
+            'snapshot': self.store.snapshots[-1],
+            'categories': {cat_name: self.store.items(cat_name) for cat_name in self.store.state['categories']},
+            'infos': self.store.state['informations']
+        }))
+
+    def render_index(self) -> bool:
+        """Render archive index, one entry per archived page (latest snapshot of a name)"""
+        pages = {}
+        for snapshot in self.store.snapshots:
+            pages[snapshot['name']] = snapshot
+        template = self._jinja_env.get_template('archive_index.html')
+        return files_tools.write_output(self.page_file('index'), template.generate({
+            'asset_url': assets_tools.asset_url_function(self.archive_dir()),
+            'pages': sorted(pages.values(), key=lambda snapshot: snapshot['name'], reverse=True)
+        }))
@@ -0,0 +1,215 @@
+import os
+import glob
+import json
+import shutil
+import base64
+import hashlib
+import logging
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List
+from mtpublishers.core import Publisher, process_pool_context
+from mtpublishers.website import jinja_environment
+from mtpublishers import config
+import mtpublishers.tools.data as data_tools
+import mtpublishers.tools.files as files_tools
+from mtpublishers.tools.covers import CoverFetcher, cover_fetcher
+from mtpublishers.tools.profiling import tracer
+
+logger = logging.getLogger(__name__)
+
+CARD_FIELDS = ('imdb_id', 'title', 'year', 'rating', 'cover_url', 'genres', 'language_codes')
+_CARD_VERSION = 2
+
+
+def emoji_char(css_class: str) -> str:
+    """Unicode emoji of an emoji-css class (em-fire -> U+1F525), None if unknown"""
+    try:
+        return unicodedata.lookup(css_class[len('em-'):].replace('_', ' ').upper())
+    except KeyError:
+        return None
+
+
+def card_vars(fields: dict) -> dict:
+    """Card template vars of item fields
+
+    Genre emojis are picked with imdb_id as seed: a card only depends on
+    its item fields.
+    """
+    genres = []
+    for genre_emoji in data_tools.add_emojis_genre(fields.get('genres'), seed=fields.get('imdb_id')):
+        genres.append({'genre': genre_emoji['genre'], 'emoji': emoji_char(genre_emoji['emoji'])})
+    return {'item': fields, 'genres': genres}
+
+
+def _init_card_process(sections: dict):
+    """Load config in a spawned pool process"""
+    config.load_sections(sections)
+
+
+def _render_card(job: tuple) -> str:
+    """Render one card in its cache file, run in pool processes"""
+    key, fields, template_name, cache_file, cover = job
+    vars = card_vars(fields)
+    vars['cover'] = 'data:%s;base64,%s' % (CoverFetcher.mime_type(fields['cover_url']), base64.b64encode(cover).decode()) \
+        if cover else fields.get('cover_url')
+    files_tools.atomic_write(cache_file, jinja_environment().get_template(template_name).generate(vars))
+    return key
+
+
+class CardPublisher(Publisher):
+    """Render an image card (svg) per item of changed categories
+
+    Covers are fetched (and revalidated) first, by [cards] fetch_workers
+    threads. Cards are stored once in [directory] cards_cache under a key
+    made of the card fields, the cover digest and the template digest, so
+    an unchanged item is never rendered again. Missing cards are rendered
+    in a pool of [cards] workers processes, then copied to
+    [directory] cards/CATEGORY/IMDB_ID.svg.
+
+    The cache is internal state, it is kept out of the published
+    directories: default cards.cache next to [hash] file. It keeps the
+    keys of each category, cards no category uses are removed.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._template = config.get('cards', 'template', fallback='card.svg')
+        self._workers = config.getint('cards', 'workers', fallback=0) or os.cpu_count() or 1
+        self._fetcher = cover_fetcher(config.get('cards', 'fetcher', fallback='http'))
+        self._fetch_workers = config.getint('cards', 'fetch_workers', fallback=8)
+
+    @staticmethod
+    def cache_dir() -> str:
+        cache_dir = config.get('directory', 'cards_cache', fallback='')
+        if cache_dir:
+            return cache_dir
+        hash_file = config.get('hash', 'file', fallback='')
+        if not hash_file:
+            raise ValueError("No cards cache: set [directory] cards_cache or [hash] file")
+        return os.path.join(os.path.dirname(os.path.abspath(hash_file)), 'cards.cache')
+
+    def move_published_cache(self, cache_dir: str):
+        """Move a cache left in the cards directory by previous versions"""
+        published = os.path.join(config.get('directory', 'cards'), '.cache')
+        if os.path.abspath(published) == os.path.abspath(cache_dir) or not os.path.isdir(published):
+            return
+        if os.path.exists(cache_dir):
+            logger.warning("cards cache removed from published directory: %s" % published)
+            shutil.rmtree(published)
+            return
+        logger.warning("cards cache moved out of published directory: %s -> %s" % (published, cache_dir))
+        os.makedirs(os.path.dirname(os.path.abspath(cache_dir)), exist_ok=True)
+        shutil.move(published, cache_dir)
+
+    def template_digest(self) -> str:
+        return files_tools.file_digest(os.path.join(config.get('directory', 'jinja'), self._template))
+
+    def card_key(self, fields: dict, template_digest: str, cover_digest: str = None) -> str:
+        content = repr((_CARD_VERSION, template_digest, cover_digest, tuple(fields.get(f) for f in CARD_FIELDS)))
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def cache_file(self, key: str) -> str:
+        return os.path.join(self.cache_dir(), key[:2], '%s.svg' % key)
+
+    def keys_file(self, cat_name: str) -> str:
+        return os.path.join(self.cache_dir(), '%s.keys' % cat_name)
+
+    def card_file(self, cat_name: str, imdb_id: str) -> str:
+        return os.path.join(config.get('directory', 'cards'), cat_name, '%s.svg' % imdb_id)
+
+    def fetch_covers(self, items: List[dict]) -> dict:
+        """cover url -> cover content (None if it can't be fetched) of items"""
+        urls = list(dict.fromkeys(item.get('cover_url') for item in items if item.get('cover_url')))
+        if not self._fetcher or not urls:
+            return {}
+        with ThreadPoolExecutor(max_workers=max(1, min(self._fetch_workers, len(urls)))) as executor:
+            return dict(zip(urls, executor.map(self._fetcher.fetch, urls)))
+
+    def render_cards(self, jobs: List[tuple]):
+        """Render missing cards, in a process pool when there is more than one
+
+        Processes are forked only when no other thread runs, else they are
+        started fresh with the config of this process, see process_pool_context.
+        """
+        if not jobs:
+            return
+        workers = min(self._workers, len(jobs))
+        if workers <= 1:
+            for job in jobs:
+                _render_card(job)
+            return
+        mp_context, fork = process_pool_context()
+        pool_kwargs = {'mp_context': mp_context}
+        if not fork:
+            pool_kwargs.update(initializer=_init_card_process, initargs=(config.raw_sections(),))
+        with ProcessPoolExecutor(max_workers=workers, **pool_kwargs) as executor:
+            for _ in executor.map(_render_card, jobs, chunksize=max(1, len(jobs) // (workers * 4))):
+                pass
+
+    def publish(self):
+        try:
+            template_digest = self.template_digest()
+            if template_digest is None:
+                raise FileNotFoundError("card template %s not found" % self._template)
+            self.move_published_cache(self.cache_dir())
+            for cat_name in self.data.category_items:
+                if cat_name not in self.changed_categories:
+                    logger.debug("%s category didn't change: skip" % cat_name)
+                    continue
+                items = self.data.category_items[cat_name].unique_items
+                with tracer.span('cards:%s' % cat_name, rows=len(items)) as span:
+                    covers = self.fetch_covers(items)
+                    cards = {}
+                    jobs = []
+                    queued = set()
+                    for item in items:
+                        fields = {f: item.get(f) for f in CARD_FIELDS}
+                        cover = covers.get(fields.get('cover_url'))
+                        key = self.card_key(fields, template_digest, hashlib.sha1(cover).hexdigest() if cover else None)
+                        cards[item.get('imdb_id')] = key
+                        if key not in queued and not os.path.exists(self.cache_file(key)):
+                            queued.add(key)
+                            jobs.append((key, fields, self._template, self.cache_file(key), cover))
+                    span['rendered'] = len(jobs)
+                    self.render_cards(jobs)
+                    span['changed'] = 0
+                    for imdb_id, key in cards.items():
+                        with open(self.cache_file(key), 'rb') as card:
+                            span['changed'] += files_tools.write_output(self.card_file(cat_name, imdb_id), [card.read()])
+                    self.remove_stale_cards(cat_name, cards)
+                    files_tools.atomic_write(self.keys_file(cat_name), [json.dumps(sorted(set(cards.values())))])
+            with tracer.span('cards:prune') as span:
+                span['removed'] = self.prune_cache()
+        except Exception as err:
+            logger.error("Error while publishing cards: %s" % str(err))
+            return False
+        return True
+
+    def remove_stale_cards(self, cat_name: str, cards: dict):
+        """Remove cards of items no longer in the category"""
+        for card_file in glob.glob(os.path.join(config.get('directory', 'cards'), cat_name, '*.svg')):
+            if os.path.splitext(os.path.basename(card_file))[0] not in cards:
+                files_tools.remove_output(card_file)
+                logger.debug("stale card %s removed" % card_file)
+
+    def prune_cache(self) -> int:
+        """Remove cached cards no category uses, and keys of categories no longer published
+
+        Returns:
+            int: number of cards removed
+        """
+        used = set()
+        for keys_file in glob.glob(os.path.join(self.cache_dir(), '*.keys')):
+            if os.path.splitext(os.path.basename(keys_file))[0] not in self.data.category_items:
+                os.remove(keys_file)
+                continue
+            with open(keys_file, 'r') as keys:
+                used.update(json.load(keys))
+        removed = 0
+        for cache_file in glob.glob(os.path.join(self.cache_dir(), '*', '*.svg')):
+            if os.path.splitext(os.path.basename(cache_file))[0] not in used:
+                os.remove(cache_file)
+                removed += 1
+        logger.debug("%d cached cards removed" % removed)
+        return removed
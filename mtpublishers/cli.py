@@ -2,12 +2,11 @@ from abc import ABC, abstractmethod
 import argparse
 import sys
 import logging
-import mtpublishers.tools.config as cfg
 from mtpublishers import config
-from mtpublishers.tasks import publish
+from mtpublishers.tasks import PUBLISHERS, publish, watch, retry, compile_templates
+from mtpublishers.tools.profiling import profile_call
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level="DEBUG")
 
 
 def _argument_config_file(parser):
@@ -19,13 +18,42 @@ def _argument_mode(parser):
 
 
 def _argument_publishers(parser):
-    parser.add_argument("-p", "--publishers", help="Which publishers must publish data", type=str, nargs="+", choices=["website"])
+    parser.add_argument("-p", "--publishers", help="Which publishers must publish data", type=str, nargs="+", choices=sorted(PUBLISHERS))
 
 
 def _argument_force(parser):
     parser.add_argument("-f", "--force", help="Force publish even if data doesn't change", action="store_true")
 
 
+def _argument_workers(parser):
+    parser.add_argument("-w", "--workers", help="Publishers running concurrently. Override [publish] workers", type=int)
+
+
+def _argument_timeout(parser):
+    parser.add_argument("-t", "--timeout", help="Max seconds per publisher. Override [publish] timeout", type=float)
+
+
+def _argument_interval(parser):
+    parser.add_argument("-i", "--interval", help="Seconds between database checks. Override [watch] interval", type=float)
+
+
+def _argument_debounce(parser):
+    parser.add_argument("-d", "--debounce", help="Seconds database must stay unchanged before publishing. Override [watch] debounce", type=float)
+
+
+def _argument_target(parser):
+    parser.add_argument("--target", help="Output directory. Override [directory] jinja_compiled", type=str)
+
+
+def _argument_from_snapshot(parser):
+    parser.add_argument("-s", "--from-snapshot", help="Load data from this snapshot file instead of sqlite. Defaults to [snapshot] file",
+                        type=str, nargs="?", const="")
+
+
+def _argument_profile(parser):
+    parser.add_argument("--profile", help="Dump cProfile stats of the run (main thread only) in this file", type=str)
+
+
 def _argument_test(parser):
     parser.add_argument("--test", help="Action is not really called", action='store_true')
 
@@ -70,12 +98,51 @@ class PublishParser(AbstractParser):
     def build(self):
         _argument_publishers(self.parser)
         _argument_force(self.parser)
+        _argument_workers(self.parser)
+        _argument_timeout(self.parser)
+        _argument_from_snapshot(self.parser)
+        _argument_profile(self.parser)
         _argument_test(self.parser)
 
-    def task(self, **kwargs):
+    def task(self, profile=None, **kwargs):
+        if profile:
+            return profile_call(profile, publish, **kwargs)
         publish(**kwargs)
 
 
+class WatchParser(AbstractParser):
+
+    def build(self):
+        _argument_publishers(self.parser)
+        _argument_force(self.parser)
+        _argument_workers(self.parser)
+        _argument_timeout(self.parser)
+        _argument_interval(self.parser)
+        _argument_debounce(self.parser)
+
+    def task(self, **kwargs):
+        watch(**kwargs)
+
+
+class RetryParser(AbstractParser):
+
+    def build(self):
+        _argument_workers(self.parser)
+        _argument_timeout(self.parser)
+
+    def task(self, **kwargs):
+        retry(**kwargs)
+
+
+class CompileTemplatesParser(AbstractParser):
+
+    def build(self):
+        _argument_target(self.parser)
+
+    def task(self, **kwargs):
+        compile_templates(**kwargs)
+
+
 class MTPublishersCLI(AbstractParser):
 
     def __init__(self):
@@ -98,7 +165,7 @@ class MTPublishersCLI(AbstractParser):
         config_dir = parsed_args_dict.get('config_dir', None)
         mode = parsed_args_dict.get('mode', None)
         if config_dir or mode:
-            cfg.populate_config(config=config, user_dir_config=config_dir, mode=mode, reload_=True)
+            config.populate(user_dir_config=config_dir, mode=mode)
 
         super().execute(args)
 
@@ -107,9 +174,13 @@ class TopLevelSubParsers(AbstractSubParsers):
 
     def add_parsers(self):
         PublishParser(self.subparsers.add_parser("publish", help="Publish medias trends"))
+        WatchParser(self.subparsers.add_parser("watch", help="Publish medias trends each time data changes"))
+        RetryParser(self.subparsers.add_parser("retry", help="Retry failed publications of the outbox"))
+        CompileTemplatesParser(self.subparsers.add_parser("compile-templates", help="Precompile jinja templates"))
 
 
 def main():
+    logging.basicConfig(level="DEBUG")
     cli = MTPublishersCLI()
     try:
         cli.execute()
@@ -1,9 +1,22 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Iterable, List
 import logging
 import hashlib
+import json
+import math
+import time
+import itertools
+import threading
+import functools
+import multiprocessing
+from collections import namedtuple
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from mtpublishers import config
 import mtpublishers.tools.data as data_tools
+from mtpublishers.tools.cache import QueryCache
+from mtpublishers.tools.profiling import tracer
+from mtpublishers.tools.snapshot import SnapshotReader, write_snapshot
 
 logger = logging.getLogger(__name__)
 
@@ -13,11 +26,18 @@ logger = logging.getLogger(__name__)
 
 
 class CategoryItems():
+    """Items of a category
 
-    def __init__(self, category: str, items: List[dict] = []):
+    Indexes, aggregates and sorted views are built on first use and dropped
+    when items change through this class (setter, append, extend,
+    consolidate). Mutating items list directly leaves them stale.
+    """
+
+    def __init__(self, category: str, items: List[dict] = None):
         self._items = []
+        self._indexes = {}
         self._category = None
-        self.items = items
+        self.items = items if items is not None else []
         self.category = category
 
     @property
@@ -41,11 +61,23 @@ class CategoryItems():
                 'genres': list, # nullable
                 'language_codes': list # nullable
         }, ...]
+
+        Items can also be data_tools.MediaItem records. They are
+        consolidated while being copied.
         """
         if not isinstance(items, list):
             raise TypeError("items must be instance of list")
-        self._items = items
-        self.consolidate()
+        self._items = []
+        self._indexes.clear()
+        self.extend(items)
+
+    @classmethod
+    def from_consolidated(cls, category: str, items: list):
+        """CategoryItems of items already consolidated, e.g. from a snapshot"""
+        category_items = cls(category=category)
+        category_items._items = items
+        category_items._indexes.clear()
+        return category_items
 
     @property
     def category(self):
@@ -59,16 +91,154 @@ class CategoryItems():
 
     @property
     def imdb_ids(self):
-        return [item.get('imdb_id') for item in self.items if item.get('imdb_id', None)]
+        """Distinct imdb ids, in items order"""
+        return list(self.by_imdb_id())
+
+    @property
+    def count(self):
+        return len(self._items)
+
+    @property
+    def unique_items(self):
+        """Items deduplicated on imdb_id (first one kept), items without id excluded"""
+        return list(self.by_imdb_id().values())
+
+    @property
+    def max_valid_date(self):
+        def build():
+            valid_dates = [item.get('valid_date') for item in self._items if item.get('valid_date') is not None]
+            return max(valid_dates) if valid_dates else None
+        return self._index('max_valid_date', build)
+
+    def _index(self, name, build):
+        if name not in self._indexes:
+            self._indexes[name] = build()
+        return self._indexes[name]
+
+    def _group_by(self, values) -> dict:
+        groups = {}
+        for item in self._items:
+            for value in values(item):
+                groups.setdefault(value, []).append(item)
+        return groups
+
+    def by_imdb_id(self) -> dict:
+        """imdb_id -> item, first item kept when an id is repeated"""
+        def build():
+            index = {}
+            for item in self._items:
+                imdb_id = item.get('imdb_id')
+                if imdb_id and imdb_id not in index:
+                    index[imdb_id] = item
+            return index
+        return self._index('imdb_id', build)
+
+    def get(self, imdb_id: str, default=None):
+        return self.by_imdb_id().get(imdb_id, default)
+
+    def by_year(self) -> dict:
+        """year -> items, items without year under None"""
+        return self._index('year', lambda: self._group_by(lambda item: [item.get('year')]))
+
+    def by_genre(self) -> dict:
+        """lower case genre -> items"""
+        return self._index('genre', lambda: self._group_by(
+            lambda item: set(genre.lower() for genre in item.get('genres') or [])))
+
+    def by_language(self) -> dict:
+        """lower case language code -> items"""
+        return self._index('language', lambda: self._group_by(
+            lambda item: set(code.lower() for code in item.get('language_codes') or [])))
+
+    def sorted_by(self, field: str, reverse: bool = True) -> list:
+        """Items sorted on field (e.g. score, rating), items without value last
+
+        Args:
+            field (str): item field
+            reverse (bool, optional): descending order. Defaults to True.
+        """
+        def build():
+            with_value = [item for item in self._items if item.get(field) is not None]
+            without_value = [item for item in self._items if item.get(field) is None]
+            return sorted(with_value, key=lambda item: item.get(field), reverse=reverse) + without_value
+        return self._index(('sorted', field, reverse), build)
 
     def append(self, item: dict):
-        self.items.append(item)
+        return self.extend([item])
+
+    def extend(self, items: Iterable[dict]):
+        """Append and consolidate items in a single pass
+
+        Args:
+            items (Iterable[dict]): any iterable, e.g. data_tools.stream_items
+        """
+        self._items.extend(data_tools.enrich_items(items))
+        self._indexes.clear()
         return self
 
     def consolidate(self):
+        with tracer.span('consolidate', category=self.category, rows=len(self._items)):
+            self._items = list(data_tools.enrich_items(self._items))
+            self._indexes.clear()
+
+    def split_by_year(self, year: int):
+        """Split items between recent (year and after) and old ones
+
+        Items without year are old ones.
+
+        Returns:
+            tuple: (recent items, old items), both in items order
+        """
+        def build():
+            recent, old = [], []
+            for item in self._items:
+                item_year = item.get('year')
+                (recent if item_year is not None and item_year >= year else old).append(item)
+            return recent, old
+        return self._index(('split_by_year', year), build)
+
+    def digest(self):
+        """Digest of items content
+
+        Covers every field of data_tools.ITEM_FIELDS and items order, so any
+        change visible in publications changes the digest.
+        """
+        hash_object = hashlib.md5()
         for item in self.items:
-            item['genres_emoji'] = data_tools.add_emojis_genre(item.get('genres', []))
-            item['langs_flag'] = data_tools.add_emojis_language(item.get('language_codes', []))
+            hash_object.update(repr(tuple(item.get(f) for f in data_tools.ITEM_FIELDS)).encode())
+        return hash_object.hexdigest()
+
+
+class SnapshotCategories(Mapping):
+    """Categories of a snapshot, each one loaded on first access
+
+    Concurrent publishers share it: a category is loaded once, under a lock.
+    """
+
+    def __init__(self, reader: SnapshotReader):
+        self._reader = reader
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, category: str) -> CategoryItems:
+        if category in self._loaded:
+            return self._loaded[category]
+        with self._lock:
+            if category not in self._loaded:
+                if category not in self._reader.categories:
+                    raise KeyError(category)
+                fields = self._reader.fields
+                with tracer.span('snapshot:%s' % category) as span:
+                    items = [data_tools.MediaItem(**dict(zip(fields, row))) for row in self._reader.rows(category)]
+                    span['rows'] = len(items)
+                self._loaded[category] = CategoryItems.from_consolidated(category, items)
+        return self._loaded[category]
+
+    def __iter__(self):
+        return iter(self._reader.categories)
+
+    def __len__(self):
+        return len(self._reader.categories)
 
 
 class Observer(ABC):
@@ -82,6 +252,106 @@ class Observer(ABC):
         return
 
 
+PublishResult = namedtuple('PublishResult', ['observer', 'success', 'elapsed', 'error'])
+
+# error of an update skipped because the previous one is still running
+STILL_RUNNING = "previous update still running"
+
+# observer -> future of its update which ran out of time, see run_updates
+_timed_out_updates = {}
+_timed_out_lock = threading.Lock()
+
+
+def publish_settings(workers: int = None, timeout: float = None) -> tuple:
+    """(workers, timeout) given, else from [publish] section"""
+    workers = workers if workers else config.getint('publish', 'workers', fallback=1)
+    if timeout is None:
+        timeout = config.get('publish', 'timeout', fallback='')
+        timeout = float(timeout) if timeout else None
+    return workers, timeout
+
+
+def run_updates(updates: list, workers: int = 1, timeout: float = None) -> List[PublishResult]:
+    """Run updates one after another, or concurrently in a thread pool when
+    workers > 1 or a timeout is given
+
+    Args:
+        updates (list): (observer, callable returning its PublishResult) pairs
+        workers (int, optional): max updates running at the same time. Defaults to 1.
+        timeout (float, optional): max seconds for each update. Defaults to None.
+
+        An update running out of time is reported as failed, but its
+        thread can't be stopped: it keeps running in background and the
+        process still waits for it before exiting. A timeout bounds the
+        time until results are known, not the wall time of the run. Until
+        it returns, next updates of the same observer are skipped and
+        reported as failed (STILL_RUNNING): the observer is never updated
+        twice at the same time.
+
+    Returns:
+        List[PublishResult]: one result per update, in updates order
+    """
+    results = {}
+    with _timed_out_lock:
+        for observer, future in list(_timed_out_updates.items()):
+            if future.done():
+                del _timed_out_updates[observer]
+        for position, (observer, _) in enumerate(updates):
+            if observer in _timed_out_updates:
+                logger.error("%s update skipped: %s" % (observer, STILL_RUNNING))
+                results[position] = PublishResult(observer, False, 0, STILL_RUNNING)
+    todo = [(position, update) for position, (_, update) in enumerate(updates) if position not in results]
+
+    workers = workers if workers else 1
+    if workers <= 1 and not timeout:
+        for position, update in todo:
+            results[position] = update()
+        return [results[position] for position in range(len(updates))]
+
+    started = {}
+
+    def run(position, update):
+        started[position] = time.perf_counter()
+        return update()
+
+    executor = ThreadPoolExecutor(max_workers=max(workers, 1))
+    pending = {executor.submit(run, position, update): position for position, update in todo}
+    try:
+        while pending:
+            done, _ = wait(pending, timeout=0.05 if timeout else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[pending.pop(future)] = future.result()
+            if not timeout:
+                continue
+            now = time.perf_counter()
+            for future, position in list(pending.items()):
+                if position in started and now - started[position] > timeout:
+                    observer = updates[position][0]
+                    logger.error("%s update timed out after %ss" % (observer, timeout))
+                    results[position] = PublishResult(observer, False, now - started[position], "timeout after %ss" % timeout)
+                    del pending[future]
+                    with _timed_out_lock:
+                        _timed_out_updates[observer] = future
+    finally:
+        executor.shutdown(wait=False)
+    return [results[position] for position in range(len(updates))]
+
+
+def process_pool_context() -> tuple:
+    """(multiprocessing context, forked) of publisher process pools
+
+    Processes are forked when this process runs a single thread: they
+    inherit its memory, config set at runtime included. Forking while other
+    threads run (concurrent publishers) could copy a lock one of them
+    holds, so then processes are started fresh (forkserver, else spawn)
+    and must load config themselves, see LazyConfig.raw_sections.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    if threading.active_count() == 1 and 'fork' in methods:
+        return multiprocessing.get_context('fork'), True
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn'), False
+
+
 class Subject(ABC):
 
     def __init__(self):
@@ -98,10 +368,32 @@ class Subject(ABC):
             logger.debug("Observer %s is not registered" % observer)
             pass
 
-    def notify(self, modifier=None):
-        for observer in self._observers:
-            if modifier != observer:
-                observer.update(self)
+    def update_observer(self, observer: Observer) -> PublishResult:
+        start = time.perf_counter()
+        with tracer.span('update:%s' % observer) as span:
+            try:
+                success = observer.update(self) is not False
+                error = None if success else "update reported a failure"
+            except Exception as err:
+                logger.error("Error while updating %s: %s" % (observer, err))
+                success, error = False, str(err)
+            span['success'] = success
+        return PublishResult(observer, success, time.perf_counter() - start, error)
+
+    def notify(self, modifier=None, workers: int = 1, timeout: float = None) -> List[PublishResult]:
+        """Update observers, see run_updates
+
+        Args:
+            modifier (optional): observer not to update. Defaults to None.
+            workers (int, optional): max observers updated at the same time. Defaults to 1.
+            timeout (float, optional): max seconds for each observer update. Defaults to None.
+
+        Returns:
+            List[PublishResult]: one result per updated observer, in registration order
+        """
+        observers = [observer for observer in self._observers if modifier != observer]
+        return run_updates([(observer, functools.partial(self.update_observer, observer)) for observer in observers],
+                           workers=workers, timeout=timeout)
 
 
 class MediasTrendsData(Subject):
@@ -113,6 +405,11 @@ class MediasTrendsData(Subject):
         self._hash = None
         self._hash_file = config.get('hash', 'file')
         self._hash_exists = False
+        self._manifest = {}
+        self._changed_categories = set()
+        self._failed_categories = set()
+        self._shared = {}
+        self._shared_lock = threading.Lock()
 
     @property
     def category_items(self):
@@ -123,13 +420,13 @@ class MediasTrendsData(Subject):
         if not all([isinstance(c, CategoryItems) for c in category_items]):
             raise TypeError("category_items is a list containing instance of CategoryItems")
         self._category_items = {c.category: c for c in category_items}
-        self.hash = self.create_hash()
+        self.manifest = self.create_manifest()
         return self
 
     @property
     def hash(self):
         if not self._hash:
-            self.create_hash()
+            self._hash = self.create_hash()
         return self._hash
 
     @hash.setter
@@ -141,6 +438,66 @@ class MediasTrendsData(Subject):
         self._hash = hash_
         return self
 
+    @property
+    def manifest(self):
+        return self._manifest
+
+    @manifest.setter
+    def manifest(self, manifest: dict):
+        """Manifest setter
+
+        Compare digest of each category to the saved manifest to find out
+        which categories changed since last publication.
+        """
+        if not isinstance(manifest, dict):
+            raise TypeError("manifest must be instance of dict")
+        self._manifest = manifest
+        self._hash = self.create_hash()
+        self.compare_manifest()
+        return self
+
+    def published_manifest(self, saved: dict = None) -> dict:
+        """Manifest of published content: failed categories keep their saved digest"""
+        saved = saved if saved is not None else self.open_manifest()
+        manifest = {c: digest for c, digest in self.manifest.items() if c not in self._failed_categories}
+        manifest.update({c: saved[c] for c in self._failed_categories if c in saved})
+        return manifest
+
+    def compare_manifest(self):
+        """Find out changed categories and whether data is already published"""
+        saved = self.open_manifest()
+        published = self.published_manifest(saved)
+        self._changed_categories = set(c for c, digest in published.items() if saved.get(c) != digest)
+        self._hash_exists = saved == published
+
+    @property
+    def changed_categories(self):
+        """Categories whose content changed since last publication"""
+        return self._changed_categories
+
+    @changed_categories.setter
+    def changed_categories(self, categories: set):
+        self._changed_categories = set(categories)
+
+    @property
+    def failed_categories(self):
+        """Categories which couldn't be loaded
+
+        They are never published: their previous publication stays online,
+        their saved digest is kept and no snapshot of the data is saved.
+        """
+        return self._failed_categories
+
+    @failed_categories.setter
+    def failed_categories(self, categories: set):
+        self._failed_categories = set(categories)
+        self.compare_manifest()
+
+    @property
+    def hash_exists(self):
+        """True when this data is already published"""
+        return self._hash_exists
+
     @property
     def informations(self):
         return self._informations
@@ -154,41 +511,124 @@ class MediasTrendsData(Subject):
     def add_information(self, key: str, value: str):
         self._informations[key] = value
 
+    def shared(self, name, build):
+        """Value built once, by the first publisher asking for it, and shared
+        by publishers of this data (e.g. feed records of a category)
+
+        Shared values are dropped once a notify is over.
+        """
+        with self._shared_lock:
+            if name not in self._shared:
+                self._shared[name] = build()
+            return self._shared[name]
+
+    def save_snapshot(self, path: str):
+        """Save consolidated items, informations and manifest in a snapshot file"""
+        fields = data_tools.MediaItem.__slots__
+        with tracer.span('snapshot:save'):
+            write_snapshot(path, fields, self.informations, self.manifest, {
+                cat_name: [tuple(item.get(f) for f in fields) for item in category.items]
+                for cat_name, category in self.category_items.items()
+            }, failed=sorted(self._failed_categories))
+
+    def snapshot_outdated(self, path: str) -> bool:
+        """False when path already holds a snapshot of this data (same digests and informations)
+
+        Only the snapshot header is read.
+        """
+        try:
+            reader = SnapshotReader(path)
+        except Exception:
+            return True
+        return reader.manifest != self.manifest or reader.informations != self.informations or bool(reader.failed)
+
     def get_movies(self):
         return self._category_items.get('movies', None)
 
     def get_series(self):
         return self._category_items.get('series', None)
 
-    def create_hash(self):
-        imdb_ids = []
-        for cat_name, category in self.category_items.items():
-            imdb_ids.extend(category.imdb_ids)
-        imdb_ids.sort()
-        hash_object = hashlib.md5(''.join(imdb_ids).encode())
+    def create_manifest(self):
+        with tracer.span('create_hash', categories=len(self.category_items)):
+            return {cat_name: category.digest() for cat_name, category in self.category_items.items()}
+
+    def create_hash(self, manifest: dict = None):
+        manifest = manifest if manifest is not None else self.manifest
+        hash_object = hashlib.md5()
+        for cat_name in sorted(manifest):
+            hash_object.update(('%s:%s;' % (cat_name, manifest[cat_name])).encode())
         return hash_object.hexdigest()
 
     def save_hash(self):
+        """Save digests of published content, see published_manifest"""
+        manifest = self.published_manifest()
         with open(self._hash_file, 'w') as file_hash:
-            file_hash.write(self.hash)
+            json.dump({'hash': self.create_hash(manifest), 'categories': manifest}, file_hash, indent=2, sort_keys=True)
 
-    def open_hash(self):
-        hash_ = None
+    def _read_hash_file(self):
+        """Saved hash file content
+
+        Returns:
+            dict: {'hash': str, 'categories': {category: digest}}. Files
+            written before per category digests only hold a hash: no category
+            is known and everything is considered changed.
+        """
         try:
             with open(self._hash_file, 'r') as file_hash:
-                hash_ = file_hash.read()
+                content = file_hash.read()
         except FileNotFoundError:
-            pass
-        return hash_
+            return {'hash': None, 'categories': {}}
+        try:
+            saved = json.loads(content)
+        except ValueError:
+            return {'hash': content, 'categories': {}}
+        if not isinstance(saved, dict):
+            return {'hash': content, 'categories': {}}
+        return {'hash': saved.get('hash'), 'categories': saved.get('categories', {})}
+
+    def open_hash(self):
+        return self._read_hash_file().get('hash')
+
+    def open_manifest(self):
+        return self._read_hash_file().get('categories')
 
     def clear_hash(self):
         self._hash_exists = False
+        self._changed_categories = set(self.category_items.keys()) - self._failed_categories
+
+    def notify(self, workers: int = None, timeout: float = None, save: bool = True) -> List[PublishResult]:
+        """Notify publishers when data changed
+
+        Hash is saved only when every publisher succeeded.
 
-    def notify(self):
+        Args:
+            workers (int, optional): publishers running at the same time. Defaults to [publish] workers.
+            timeout (float, optional): max seconds per publisher. Defaults to [publish] timeout.
+            save (bool, optional): save hash on success, else caller does. Defaults to True.
+
+        Returns:
+            List[PublishResult]: publishers results
+        """
+        if self._failed_categories:
+            logger.error("Categories %s failed to load: not published" % ', '.join(sorted(self._failed_categories)))
         if self._hash_exists:
-            return
-        super().notify()
-        self.save_hash()
+            return []
+        workers, timeout = publish_settings(workers, timeout)
+        try:
+            results = super().notify(workers=workers, timeout=timeout)
+        finally:
+            with self._shared_lock:
+                self._shared.clear()
+        for result in results:
+            logger.info("publisher %s: %s in %.3fs%s" % (
+                result.observer, 'success' if result.success else 'failure', result.elapsed,
+                '' if result.success else ' (%s)' % result.error))
+        if all(result.success for result in results):
+            if save:
+                self.save_hash()
+        else:
+            logger.error("Some publishers failed: hash is not saved")
+        return results
 
 
 class Publisher(Observer):
@@ -207,6 +647,11 @@ class Publisher(Observer):
         self._data = data
         return self
 
+    @property
+    def changed_categories(self):
+        """Categories to publish: only those which changed since last publication"""
+        return self.data.changed_categories if self.data else set()
+
     def update(self, data: MediasTrendsData):
         self.data = data
         return self.publish()
@@ -239,27 +684,207 @@ def data_from_static_gen():
     return mt_data
 
 
-def data_from_sql():
+def data_to_cache(mt_data: MediasTrendsData) -> dict:
+    """Raw data (before consolidation) to store in query cache"""
+    return {
+        'informations': dict(mt_data.informations),
+        'categories': {
+            cat_name: [{f: item.get(f) for f in data_tools.ITEM_FIELDS if f in item} for item in category.items]
+            for cat_name, category in mt_data.category_items.items()
+        }
+    }
+
 
+def data_from_cache(payload: dict) -> MediasTrendsData:
+    """Rebuild mediastrends data from a query cache entry"""
     mt_data = MediasTrendsData()
+    mt_data.informations = dict(payload['informations'])
+    mt_data.category_items = [
+        CategoryItems(category=cat_name).extend(data_tools.MediaItem(**item) for item in items)
+        for cat_name, items in payload['categories'].items()
+    ]
+    return mt_data
+
+
+CategoryDefinition = namedtuple('CategoryDefinition', ['name', 'sql', 'template'])
+
+
+def category_definitions() -> List[CategoryDefinition]:
+    """Categories declared in [category.NAME] config sections
+
+    Each section gives the sql resource of the category and its template
+    name. Sections without sql are ignored.
+    """
+    definitions = []
+    for section in config.sections():
+        if not section.startswith('category.'):
+            continue
+        name = section[len('category.'):]
+        sql = config.get(section, 'sql', fallback='')
+        if not sql:
+            continue
+        definitions.append(CategoryDefinition(name, sql, config.get(section, 'template', fallback=name)))
+    return definitions
+
+
+def data_from_snapshot(path: str) -> MediasTrendsData:
+    """Mediastrends data saved with MediasTrendsData.save_snapshot
+
+    Categories are read lazily: only those accessed by publishers are loaded.
+    """
+    reader = SnapshotReader(path)
+    mt_data = MediasTrendsData()
+    mt_data.informations = dict(reader.informations)
+    mt_data._category_items = SnapshotCategories(reader)
+    mt_data.manifest = dict(reader.manifest)
+    if reader.failed:
+        mt_data.failed_categories = reader.failed
+    return mt_data
+
+
+def _started(stream: Iterable) -> Iterable:
+    """Run stream until its first item, its query then runs in the calling thread"""
+    first = next(stream, None)
+    return stream if first is None else itertools.chain([first], stream)
+
+
+def category_from_sql(category: str, sql: str, databases: List[str] = None) -> CategoryItems:
+    """Query a category on its own read-only connection
+
+    With several databases, each one is queried on its own connection, in
+    parallel, and items are merged on imdb_id while they are streamed (see
+    data_tools.merge_items), with [sqlite] score_aggregation. Merged items
+    are ordered on score.
+    """
+    databases = databases if databases else data_tools.sqlite_databases()
+    category_items = CategoryItems(category=category)
+    if len(databases) == 1:
+        with data_tools.SQLiteConnectionManager(databases[0]) as db, tracer.span('sql:%s' % category) as span:
+            category_items.extend(data_tools.stream_items(db.execute(sql)))
+            span['rows'] = len(category_items.items)
+        return category_items
+
+    aggregation = config.get('sqlite', 'score_aggregation', fallback='max')
+    workers = max(1, min(config.getint('sqlite', 'workers', fallback=4), len(databases)))
+    with tracer.span('sql:%s' % category, databases=len(databases), aggregation=aggregation) as span:
+        generators = [data_tools.sorted_items(database, sql) for database in databases]
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                streams = list(executor.map(_started, generators))
+            items = list(data_tools.merge_items(streams, aggregation))
+        finally:
+            for generator in generators:
+                generator.close()
+        items.sort(key=lambda item: (item.get('score') is None, -(item.get('score') or 0)))
+        category_items.extend(items)
+        span['rows'] = len(category_items.items)
+    return category_items
+
+
+def _number(value):
+    """int or float of a number or of a numeric string (TEXT column), else None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if not isinstance(value, str):
+        return None
+    for cast in (int, float):
+        try:
+            number = cast(value.strip())
+        except ValueError:
+            continue
+        return number if math.isfinite(number) else None
+    return None
+
+
+def _merge_informations(informations: List[dict]) -> dict:
+    """Informations of several databases: numbers (numeric strings included)
+    are summed, other values are the greatest"""
+    merged = {}
+    for database_informations in informations:
+        for name, value in database_informations.items():
+            if name not in merged or value is None:
+                merged.setdefault(name, value)
+                continue
+            number, merged_number = _number(value), _number(merged[name])
+            if number is not None and merged_number is not None:
+                merged[name] = merged_number + number
+            elif merged[name] is None or str(value) > str(merged[name]):
+                merged[name] = value
+    return merged
+
+
+def informations_from_sql(sql: str, databases: List[str]) -> dict:
+    """Informations of each database, merged with _merge_informations
+
+    First database is read on the shared connection.
+    """
+    informations = [dict(data_tools.shared_connection().execute(sql))]
+    for database in databases[1:]:
+        with data_tools.SQLiteConnectionManager(database) as db:
+            informations.append(dict(db.execute(sql)))
+    return _merge_informations(informations)
+
+
+def data_from_sql():
 
     infos_sql = data_tools.read_sql("mediastrends_informations.sql")
-    with data_tools.connect_sqlite(factory=None) as conn:
-        for info_name, info_value in conn.execute(infos_sql):
-            mt_data.add_information(info_name, info_value)
+    categories_sql = {}
+    failed = set()
+    for definition in category_definitions():
+        try:
+            categories_sql[definition.name] = data_tools.read_sql(definition.sql)
+        except Exception as err:
+            logger.error("Error during %s sql: %s" % (definition.name, err))
+            categories_sql[definition.name] = None
+            failed.add(definition.name)
+
+    databases = data_tools.sqlite_databases()
+    query_cache = QueryCache.from_config()
+    cache_key = None
+    if query_cache and not failed:
+        sqls = [infos_sql] + ['%s:%s' % (name, sql) for name, sql in categories_sql.items()]
+        cache_key = query_cache.key(sqls + ['aggregation:%s' % config.get('sqlite', 'score_aggregation', fallback='max')],
+                                    data_tools.databases_fingerprint(databases))
+        with tracer.span('cache:load') as span:
+            payload = query_cache.load(cache_key)
+            span['hit'] = payload is not None
+        if payload is not None:
+            return data_from_cache(payload)
 
-    movies = CategoryItems(category="movies")
-    # category: movies
-    try:
-        sql = data_tools.read_sql("trending_movies.sql")
-        conn = data_tools.connect_sqlite()
-        with conn:
-            for item in conn.execute(sql):
-                movies.append(item)
-    except Exception as err:
-        logger.error("Error during movies sql: %s" % err)
-
-    movies.consolidate()
-    mt_data.category_items = [movies]
+    mt_data = MediasTrendsData()
+
+    # categories are queried concurrently, each on its own connection
+    workers = max(1, min(config.getint('sqlite', 'workers', fallback=4), len(categories_sql)))
+    categories = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            name: executor.submit(category_from_sql, name, sql, databases)
+            for name, sql in categories_sql.items() if sql
+        }
+
+        with tracer.span('sql:informations', databases=len(databases)) as span:
+            for info_name, info_value in informations_from_sql(infos_sql, databases).items():
+                mt_data.add_information(info_name, info_value)
+            span['rows'] = len(mt_data.informations)
+
+        for name in categories_sql:
+            try:
+                if name not in futures:
+                    raise ValueError("no sql")
+                categories.append(futures[name].result())
+            except Exception as err:
+                logger.error("Error during %s sql: %s" % (name, err))
+                categories.append(CategoryItems(category=name))
+                failed.add(name)
+
+    mt_data.category_items = categories
+    if failed:
+        mt_data.failed_categories = failed
+
+    if query_cache and not failed:
+        with tracer.span('cache:save'):
+            query_cache.save(cache_key, data_to_cache(mt_data))
 
     return mt_data
@@ -0,0 +1,168 @@
+import os
+import json
+import logging
+import datetime
+from abc import abstractmethod
+from email.utils import format_datetime
+from typing import Iterator, List
+from xml.sax.saxutils import escape
+from mtpublishers.core import Publisher, MediasTrendsData
+from mtpublishers import config
+import mtpublishers.tools.files as files_tools
+from mtpublishers.tools.profiling import tracer
+
+logger = logging.getLogger(__name__)
+
+_IMDB_URL = 'http://www.imdb.com/title/tt%s/'
+
+
+def _as_datetime(value) -> datetime.datetime:
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    try:
+        return datetime.datetime.strptime(str(value)[:19], '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        pass
+    try:
+        return datetime.datetime.strptime(str(value)[:10], '%Y-%m-%d')
+    except ValueError:
+        return None
+
+
+def _serialize_item(item: dict) -> dict:
+    updated = _as_datetime(item.get('valid_date'))
+    if updated is not None and updated.tzinfo is None:
+        updated = updated.replace(tzinfo=datetime.timezone.utc)
+    return {
+        'imdb_id': item.get('imdb_id'),
+        'title': item.get('title'),
+        'url': _IMDB_URL % item.get('imdb_id'),
+        'year': item.get('year'),
+        'rating': item.get('rating'),
+        'score': item.get('score'),
+        'cover_url': item.get('cover_url'),
+        'genres': list(item.get('genres') or []),
+        'language_codes': list(item.get('language_codes') or []),
+        'updated': updated.isoformat() if updated else None,
+        'updated_rfc822': format_datetime(updated) if updated else None
+    }
+
+
+def serialize_category(data: MediasTrendsData, category: str) -> List[dict]:
+    """Feed records of a category, shared by every feed publisher
+
+    Items are walked once per category of a data, whatever the number of
+    feed formats published. Records are shared on the data and dropped once
+    its publishers are notified, see MediasTrendsData.shared.
+    """
+    def build() -> List[dict]:
+        with tracer.span('serialize:%s' % category) as span:
+            records = [_serialize_item(item) for item in data.category_items[category].items]
+            span['rows'] = len(records)
+        return records
+
+    return data.shared(('feed_records', category), build)
+
+
+class FeedPublisher(Publisher):
+    """Publish each changed category in a feed file of [directory] feeds"""
+
+    _EXTENSION = None
+
+    def publish(self):
+        try:
+            for cat_name in self.data.category_items:
+                if cat_name not in self.changed_categories:
+                    logger.debug("%s category didn't change: skip" % cat_name)
+                    continue
+                records = serialize_category(self.data, cat_name)
+                with tracer.span('%s:%s' % (self, cat_name), rows=len(records)) as span:
+                    feed_file = self.feed_file(cat_name)
+                    span['changed'] = files_tools.write_output(feed_file, self.encode(cat_name, records))
+                    span['bytes'] = os.path.getsize(feed_file)
+        except Exception as err:
+            logger.error("Error while publishing %s feed: %s" % (self._EXTENSION, str(err)))
+            return False
+        return True
+
+    def feed_file(self, cat_name: str) -> str:
+        return os.path.join(config.get('directory', 'feeds'), '%s.%s' % (cat_name, self._EXTENSION))
+
+    def feed_url(self, cat_name: str) -> str:
+        return '%s/feeds/%s.%s' % (self.site_url(), cat_name, self._EXTENSION)
+
+    @staticmethod
+    def site_url() -> str:
+        return config.get('feeds', 'site_url', fallback='').rstrip('/')
+
+    @staticmethod
+    def title(cat_name: str) -> str:
+        return '%s - %s' % (config.get('feeds', 'title', fallback='mediastrends'), cat_name)
+
+    @staticmethod
+    def updated(records: List[dict], key: str = 'updated') -> str:
+        dates = [record[key] for record in records if record[key]]
+        return max(dates) if dates else None
+
+    @abstractmethod
+    def encode(self, cat_name: str, records: List[dict]) -> Iterator[str]:
+        return
+
+
+class JSONFeedPublisher(FeedPublisher):
+
+    _EXTENSION = 'json'
+
+    def encode(self, cat_name: str, records: List[dict]) -> Iterator[str]:
+        yield '{"category": %s, "title": %s, "updated": %s, "informations": %s, "items": [' % (
+            json.dumps(cat_name), json.dumps(self.title(cat_name)), json.dumps(self.updated(records)),
+            json.dumps(self.data.informations, default=str))
+        for idx, record in enumerate(records):
+            record = {key: value for key, value in record.items() if key != 'updated_rfc822'}
+            yield '%s\n%s' % (',' if idx else '', json.dumps(record))
+        yield '\n]}\n'
+
+
+class RSSPublisher(FeedPublisher):
+
+    _EXTENSION = 'rss'
+
+    def encode(self, cat_name: str, records: List[dict]) -> Iterator[str]:
+        yield '<?xml version="1.0" encoding="utf-8"?>\n<rss version="2.0">\n<channel>\n'
+        yield '<title>%s</title>\n<link>%s</link>\n<description>%s</description>\n' % (
+            escape(self.title(cat_name)), escape(self.site_url()), escape('Popular %s lately' % cat_name))
+        for record in records:
+            yield '<item>\n<title>%s</title>\n<link>%s</link>\n<guid isPermaLink="true">%s</guid>\n' % (
+                escape(str(record['title'])), escape(record['url']), escape(record['url']))
+            yield '<description>%s</description>\n' % escape('%s - %s/10 - %s' % (
+                record['year'], record['rating'], ', '.join(record['genres'])))
+            if record['updated_rfc822']:
+                yield '<pubDate>%s</pubDate>\n' % record['updated_rfc822']
+            if record['cover_url']:
+                yield '<enclosure url="%s" length="0" type="image/jpeg"/>\n' % escape(record['cover_url'], {'"': '&quot;'})
+            yield '</item>\n'
+        yield '</channel>\n</rss>\n'
+
+
+class AtomPublisher(FeedPublisher):
+
+    _EXTENSION = 'atom'
+
+    def encode(self, cat_name: str, records: List[dict]) -> Iterator[str]:
+        updated = self.updated(records) or datetime.datetime.fromtimestamp(0, datetime.timezone.utc).isoformat()
+        yield '<?xml version="1.0" encoding="utf-8"?>\n<feed xmlns="http://www.w3.org/2005/Atom">\n'
+        yield '<title>%s</title>\n<id>%s</id>\n<updated>%s</updated>\n<link rel="self" href="%s"/>\n' % (
+            escape(self.title(cat_name)), escape(self.feed_url(cat_name)), updated,
+            escape(self.feed_url(cat_name), {'"': '&quot;'}))
+        for record in records:
+            yield '<entry>\n<title>%s</title>\n<id>%s</id>\n<link href="%s"/>\n<updated>%s</updated>\n' % (
+                escape(str(record['title'])), escape(record['url']), escape(record['url'], {'"': '&quot;'}),
+                record['updated'] or updated)
+            yield '<summary>%s</summary>\n' % escape('%s - %s/10 - %s' % (
+                record['year'], record['rating'], ', '.join(record['genres'])))
+            if record['cover_url']:
+                yield '<link rel="enclosure" type="image/jpeg" href="%s"/>\n' % escape(record['cover_url'], {'"': '&quot;'})
+            yield '</entry>\n'
+        yield '</feed>\n'
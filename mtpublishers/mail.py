@@ -0,0 +1,283 @@
+import re
+import time
+import queue
+import smtplib
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from email.policy import SMTP as SMTP_POLICY
+from email.utils import formatdate
+from typing import Dict, List
+import jinja2
+from mtpublishers.core import Publisher, MediasTrendsData
+from mtpublishers.website import jinja_environment
+from mtpublishers import config
+from mtpublishers.tools.profiling import tracer
+
+logger = logging.getLogger(__name__)
+
+_render_lock = threading.Lock()
+_sections = {}
+
+
+def render_section(env: jinja2.Environment, data: MediasTrendsData, category: str, template_name: str, max_items: int) -> str:
+    """Digest section of a category, rendered once per category content and template
+
+    Sections are kept until another data is published.
+    """
+    key = (id(data), category, data.manifest.get(category), template_name, max_items)
+    with _render_lock:
+        if key not in _sections:
+            if any(data_id != id(data) for data_id, *_ in _sections):
+                _sections.clear()
+            cat_items = data.category_items[category]
+            items = cat_items.items[:max_items] if max_items > 0 else cat_items.items
+            with tracer.span('email:render:%s' % category, rows=len(items)):
+                _sections[key] = env.get_template('%s.html' % template_name).render({
+                    'category': cat_items,
+                    'items': items,
+                    'infos': data.informations
+                })
+        return _sections[key]
+
+
+def to_header(recipient: str) -> tuple:
+    """To header of a recipient, encoded for SMTP, and its envelope address
+
+    Raises:
+        ValueError: recipient is not a single address (or holds line breaks)
+    """
+    header = SMTP_POLICY.header_store_parse('To', recipient)[1]
+    if len(header.addresses) != 1 or not header.addresses[0].addr_spec:
+        raise ValueError("%r is not an email address" % recipient)
+    return SMTP_POLICY.fold_binary('To', header), header.addresses[0].addr_spec
+
+
+class RateLimiter():
+    """Allow at most rate calls per second, shared by threads (0: no limit)"""
+
+    def __init__(self, rate: float = 0):
+        self._interval = 1 / rate if rate > 0 else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class SMTPConnectionPool():
+    """At most size SMTP connections, opened on demand and reused
+
+    A connection is logged in once and serves every message sent through
+    it. Connections raising an error are closed instead of being put back.
+    """
+
+    def __init__(self, host: str, port: int = 25, user: str = None, password: str = None,
+                 security: str = None, timeout: float = 30, size: int = 1):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.security = security
+        self.timeout = timeout
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+
+    @classmethod
+    def from_config(cls, size: int = None):
+        return cls(
+            config.get('email', 'host', fallback='localhost'),
+            port=config.getint('email', 'port', fallback=25),
+            user=config.get('email', 'user', fallback='') or None,
+            password=config.get('email', 'password', fallback='') or None,
+            security=config.get('email', 'security', fallback='') or None,
+            timeout=config.getfloat('email', 'timeout', fallback=30),
+            size=size if size else config.getint('email', 'connections', fallback=1)
+        )
+
+    def open(self) -> smtplib.SMTP:
+        if self.security == 'ssl':
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.security == 'starttls':
+                smtp.starttls()
+        if self.user:
+            smtp.login(self.user, self.password or '')
+        logger.debug("smtp connection opened to %s:%s" % (self.host, self.port))
+        return smtp
+
+    @staticmethod
+    def discard(smtp: smtplib.SMTP):
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, a new one is opened when none is idle"""
+        with self._slots:
+            try:
+                smtp = self._idle.get_nowait()
+            except queue.Empty:
+                smtp = self.open()
+            try:
+                yield smtp
+            except BaseException:
+                self.discard(smtp)
+                raise
+            self._idle.put(smtp)
+
+    def close(self):
+        while True:
+            try:
+                self.discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+class EmailPublisher(Publisher):
+    """Send a digest of changed categories to [email] recipients
+
+    Digest is rendered and encoded once, only the To header (see to_header)
+    differs between recipients. Recipients are sent in batches of [email]
+    batch_size, [email] connections batches at a time, each batch on one
+    reused SMTP connection and at most [email] rate messages per second
+    overall. Recipients the server refuses are kept in failures.
+    """
+
+    def __init__(self, jinja_env: jinja2.Environment = None, pool: SMTPConnectionPool = None):
+        super().__init__()
+        self._jinja_env = jinja_env if jinja_env else jinja_environment()
+        self._pool = pool
+        self._sender = config.get('email', 'sender', fallback='mediastrends@localhost')
+        self._subject = config.get('email', 'subject', fallback='mediastrends')
+        self._template = config.get('email', 'template', fallback='email')
+        self._max_items = config.getint('email', 'max_items', fallback=20)
+        self._batch_size = max(1, config.getint('email', 'batch_size', fallback=50))
+        self._connections = max(1, config.getint('email', 'connections', fallback=1))
+        self._rate = config.getfloat('email', 'rate', fallback=0)
+        self.failures = {}
+
+    @staticmethod
+    def recipients() -> List[str]:
+        """[email] recipients (comma or space separated) and [email] recipients_file lines"""
+        recipients = re.split(r'[\s,;]+', config.get('email', 'recipients', fallback=''))
+        recipients_file = config.get('email', 'recipients_file', fallback='')
+        if recipients_file:
+            with open(recipients_file, 'r') as lines:
+                recipients += [line.split('#')[0].strip() for line in lines]
+        return list(dict.fromkeys(recipient for recipient in recipients if recipient))
+
+    def category_template(self, cat_name: str) -> str:
+        """Template of a category section: [category.NAME] email_template, else [email] category_template"""
+        return config.get('category.%s' % cat_name, 'email_template',
+                          fallback=config.get('email', 'category_template', fallback='email_category'))
+
+    def message(self, categories: List[str]) -> bytes:
+        """Digest message without To header, encoded for SMTP"""
+        sections = [
+            render_section(self._jinja_env, self.data, cat_name, self.category_template(cat_name), self._max_items)
+            for cat_name in categories
+        ]
+        html = self._jinja_env.get_template('%s.html' % self._template).render({
+            'subject': self._subject,
+            'sections': sections,
+            'infos': self.data.informations,
+            'site_url': config.get('feeds', 'site_url', fallback='')
+        })
+        text = []
+        for cat_name in categories:
+            items = self.data.category_items[cat_name].items
+            text.append('Popular %s\n' % cat_name)
+            text += ['- %s (%s) %s/10' % (item.get('title'), item.get('year'), item.get('rating'))
+                     for item in (items[:self._max_items] if self._max_items > 0 else items)]
+            text.append('')
+        message = EmailMessage()
+        message['Subject'] = self._subject
+        message['From'] = self._sender
+        message['Date'] = formatdate(localtime=True)
+        message.set_content('\n'.join(text))
+        message.add_alternative(html, subtype='html')
+        return message.as_bytes(policy=SMTP_POLICY)
+
+    def send_batch(self, pool: SMTPConnectionPool, limiter: RateLimiter, message: bytes, batch: List[str]) -> Dict[str, str]:
+        """Send message to each recipient of batch on one connection
+
+        A dropped connection is opened again once per recipient.
+
+        Returns:
+            Dict[str, str]: refused recipient -> error
+        """
+        failures = {}
+        remaining = list(batch)
+        reconnected = False
+        while remaining:
+            try:
+                with pool.connection() as smtp:
+                    while remaining:
+                        recipient = remaining[0]
+                        limiter.wait()
+                        try:
+                            header, address = to_header(recipient)
+                            smtp.sendmail(self._sender, [address], header + message)
+                        except (ValueError, smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                                smtplib.SMTPDataError) as err:
+                            failures[recipient] = repr(err)
+                        remaining.pop(0)
+                        reconnected = False
+            except (smtplib.SMTPServerDisconnected, OSError) as err:
+                if reconnected or not remaining:
+                    for recipient in remaining:
+                        failures[recipient] = repr(err)
+                    break
+                logger.debug("smtp connection lost (%s): reconnect" % err)
+                reconnected = True
+        return failures
+
+    def publish(self):
+        self.failures = {}
+        categories = [cat_name for cat_name in self.data.category_items if cat_name in self.changed_categories]
+        if not categories:
+            logger.debug("no category changed: no email")
+            return True
+        pool = None
+        try:
+            recipients = self.recipients()
+            if not recipients:
+                logger.warning("No email recipient: set [email] recipients or recipients_file")
+                return True
+            with tracer.span('email:send', recipients=len(recipients), categories=categories) as span:
+                message = self.message(categories)
+                span['bytes'] = len(message)
+                pool = self._pool if self._pool else SMTPConnectionPool.from_config(self._connections)
+                limiter = RateLimiter(self._rate)
+                batches = [recipients[i:i + self._batch_size] for i in range(0, len(recipients), self._batch_size)]
+                with ThreadPoolExecutor(max_workers=min(self._connections, len(batches))) as executor:
+                    for failures in executor.map(lambda batch: self.send_batch(pool, limiter, message, batch), batches):
+                        self.failures.update(failures)
+                span['sent'] = len(recipients) - len(self.failures)
+                span['failures'] = self.failures
+        except Exception as err:
+            logger.error("Error while publishing email: %s" % str(err))
+            return False
+        finally:
+            if pool is not None and pool is not self._pool:
+                pool.close()
+        for recipient, error in self.failures.items():
+            logger.error("Email to %s failed: %s" % (recipient, error))
+        if len(self.failures) == len(recipients):
+            logger.error("Email could not be sent to any recipient")
+            return False
+        return True
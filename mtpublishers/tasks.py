@@ -1,34 +1,305 @@
+import os
+import json
+import time
 import logging
-from mtpublishers.website import StaticWebsitePublisher
-from mtpublishers.core import data_from_sql, data_from_static_gen
+import functools
+import importlib
+from mtpublishers.core import data_from_sql, data_from_static_gen, data_from_snapshot, PublishResult, publish_settings, \
+    run_updates, STILL_RUNNING
+import mtpublishers.tools.data as data_tools
+from mtpublishers.tools.outbox import Outbox
+from mtpublishers.tools.profiling import tracer
+from mtpublishers import config
 
 logger = logging.getLogger(__name__)
 
+# publisher name -> "module:class", imported only when requested
+PUBLISHERS = {
+    'website': 'mtpublishers.website:StaticWebsitePublisher',
+    'json': 'mtpublishers.feeds:JSONFeedPublisher',
+    'rss': 'mtpublishers.feeds:RSSPublisher',
+    'atom': 'mtpublishers.feeds:AtomPublisher',
+    'email': 'mtpublishers.mail:EmailPublisher',
+    'cards': 'mtpublishers.cards:CardPublisher',
+    'archive': 'mtpublishers.archive:ArchivePublisher',
+}
 
-def publish(publishers: list, force: bool = False, test: bool = False, sql_data=True, **kwargs):
-    publishers_call = {
-        'website': StaticWebsitePublisher
-    }
 
-    if sql_data:
-        data = data_from_sql()
-    else:
-        data = data_from_static_gen()
+def load_publisher(name: str):
+    """Import publisher class registered as name, or given as module:class"""
+    module_name, class_name = PUBLISHERS.get(name, name).split(':')
+    return getattr(importlib.import_module(module_name), class_name)
 
-    if force:
-        logger.debug("Force option is True: clear hash")
-        data.clear_hash()
 
+def run_report_file():
+    """Run report path: run_report.json next to [hash] file"""
+    hash_file = config.get('hash', 'file', fallback='')
+    if not hash_file:
+        return None
+    return os.path.join(os.path.dirname(os.path.abspath(hash_file)), 'run_report.json')
+
+
+def snapshot_file():
+    return config.get('snapshot', 'file', fallback='') or None
+
+
+def load_data(sql_data: bool = True, keep_connection: bool = False, snapshot: str = None):
+    """Load mediastrends data
+
+    Args:
+        sql_data (bool, optional): from sqlite, else static test data. Defaults to True.
+        keep_connection (bool, optional): keep shared sqlite connection open. Defaults to False.
+        snapshot (str, optional): load this snapshot file instead, '' for [snapshot] file. Defaults to None.
+
+    Data loaded from sqlite is saved in [snapshot] file when set, unless a
+    category failed to load or the file already holds this data.
+    """
+    with tracer.span('load_data', sql_data=sql_data, snapshot=snapshot) as span:
+        if snapshot is not None:
+            snapshot = snapshot if snapshot else snapshot_file()
+            if not snapshot:
+                raise ValueError("No snapshot file: set [snapshot] file")
+            span['snapshot'] = snapshot
+            return data_from_snapshot(snapshot)
+        if sql_data:
+            try:
+                data = data_from_sql()
+            finally:
+                if not keep_connection:
+                    data_tools.close_shared_connection()
+            if snapshot_file() and not data.failed_categories and data.snapshot_outdated(snapshot_file()):
+                data.save_snapshot(snapshot_file())
+        else:
+            data = data_from_static_gen()
+        span['rows'] = sum(len(category.items) for category in data.category_items.values())
+    return data
+
+
+def create_publishers(publishers: list) -> list:
+    instances = []
     for publisher in publishers:
-        if publisher not in publishers_call:
+        if publisher not in PUBLISHERS:
             logger.debug("%s publisher doesn't exist" % publisher)
             continue
+        instances.append(load_publisher(publisher)())
+    return instances
+
+
+def save_run_report():
+    report_file = run_report_file()
+    if report_file:
+        try:
+            tracer.save_report(report_file)
+        except OSError as err:
+            logger.error("Error while saving run report: %s" % err)
 
-        publisher = publishers_call.get(publisher)()
+
+def _retry_job(job: dict, loaded: dict) -> PublishResult:
+    """Publish a job payload again, its data is kept in loaded"""
+    with tracer.span('retry:%s' % job['publisher'], data_hash=job['data_hash'], attempts=job['attempts']):
+        try:
+            if not job['payload'] or not os.path.exists(job['payload']):
+                raise FileNotFoundError("payload of %s is missing" % job['data_hash'])
+            data = data_from_snapshot(job['payload'])
+            data.changed_categories = json.loads(job['categories']) if job['categories'] else data.category_items
+            loaded[job['data_hash']] = data
+            return data.update_observer(load_publisher(job['publisher'])())
+        except Exception as err:
+            return PublishResult(job['publisher'], False, 0, repr(err))
+
+
+def retry_outbox(outbox: Outbox, skip: list = None, workers: int = None, timeout: float = None) -> list:
+    """Publish again due pending jobs of the outbox from their payload
+
+    Jobs are retried like publishers are notified, see core.run_updates.
+    Hash file is saved once every publisher is done with the data of the
+    most recent jobs.
+
+    Args:
+        outbox (Outbox): outbox
+        skip (list, optional): publisher ids not to retry, e.g. about to publish newer data. Defaults to None.
+        workers (int, optional): jobs retried at the same time. Defaults to [publish] workers.
+        timeout (float, optional): max seconds per job. Defaults to [publish] timeout.
+
+    Returns:
+        list: PublishResult of retried jobs
+    """
+    jobs = [job for job in outbox.due_jobs() if not skip or job['publisher'] not in skip]
+    if not jobs:
+        return []
+    workers, timeout = publish_settings(workers, timeout)
+    loaded = {}
+    results = run_updates([(job['publisher'], functools.partial(_retry_job, job, loaded)) for job in jobs],
+                          workers=workers, timeout=timeout)
+    for job, result in zip(jobs, results):
+        logger.info("retry %s of %s: %s%s" % (
+            job['publisher'], job['data_hash'], 'success' if result.success else 'failure',
+            '' if result.success else ' (%s)' % result.error))
+        outbox.record(job['data_hash'], job['publisher'], result.success, error=result.error)
+
+    latest_hash = outbox.latest_hash()
+    if latest_hash in loaded and outbox.all_done(latest_hash):
+        logger.debug("every publisher is done with %s: save hash" % latest_hash)
+        loaded[latest_hash].save_hash()
+    return results
+
+
+def _notify_with_outbox(outbox: Outbox, data, publishers: list, force: bool, workers: int, timeout: float) -> list:
+    """Notify publishers recording one outbox job per (data hash, publisher)
+
+    Publishers already done with this data are not notified again (unless
+    forced), failed ones are left to the outbox retries. Hash file is saved
+    once every publisher is done with this data.
+    """
+    ids = {publisher: Outbox.publisher_id(publisher) for publisher in publishers}
+    jobs = outbox.jobs(data.hash)
+    fresh = [publisher for publisher in publishers if force or ids[publisher] not in jobs]
+    fresh = fresh if force or not data.hash_exists else []
+
+    results = retry_outbox(outbox, skip=[ids[publisher] for publisher in fresh], workers=workers, timeout=timeout)
+
+    for publisher in fresh:
         data.register_observer(publisher)
         logger.debug("publisher %s attached" % publisher)
 
+    with tracer.span('notify', changed_categories=sorted(data.changed_categories)):
+        fresh_results = data.notify(workers=workers, timeout=timeout, save=False)
+
+    payload = None
+    for result in fresh_results:
+        if not result.success and payload is None:
+            payload = outbox.payload_file(data.hash)
+            if not os.path.exists(payload):
+                data.save_snapshot(payload)
+        outbox.record(data.hash, ids[result.observer], result.success, error=result.error,
+                      payload=None if result.success else payload, categories=data.changed_categories)
+
+    if not data.hash_exists and outbox.all_done(data.hash, list(ids.values())):
+        data.save_hash()
+    return results + fresh_results
+
+
+def notify_publishers(data, publishers: list, force: bool = False, workers: int = None, timeout: float = None):
+    if force:
+        logger.debug("Force option is True: clear hash")
+        data.clear_hash()
+
+    outbox = Outbox.from_config()
+    if outbox:
+        try:
+            results = _notify_with_outbox(outbox, data, publishers, force, workers, timeout)
+            outbox.prune_payloads()
+        finally:
+            outbox.close()
+    else:
+        for publisher in publishers:
+            data.register_observer(publisher)
+            logger.debug("publisher %s attached" % publisher)
+
+        with tracer.span('notify', changed_categories=sorted(data.changed_categories)):
+            results = data.notify(workers=workers, timeout=timeout)
+
+    save_run_report()
+    return results
+
+
+def retry(workers: int = None, timeout: float = None, **kwargs):
+    """Retry due outbox jobs only, without loading data"""
+    tracer.reset()
+    outbox = Outbox.from_config()
+    if not outbox:
+        raise ValueError("Outbox is disabled: set [outbox] enabled and [hash] file")
+    try:
+        results = retry_outbox(outbox, workers=workers, timeout=timeout)
+        outbox.prune_payloads()
+    finally:
+        outbox.close()
+    save_run_report()
+    return results
+
+
+def publish(publishers: list, force: bool = False, test: bool = False, sql_data=True,
+            workers: int = None, timeout: float = None, from_snapshot: str = None, **kwargs):
+    tracer.reset()
+
+    data = load_data(sql_data, snapshot=from_snapshot)
+    instances = create_publishers(publishers)
+
     if test:
         logger.debug("test publish mode done")
 
-    data.notify()
+    return notify_publishers(data, instances, force=force, workers=workers, timeout=timeout)
+
+
+def _databases_state(db: data_tools.SQLiteConnectionManager) -> tuple:
+    """State of shared connection database and fingerprint of every [sqlite] path database"""
+    return db.state(), data_tools.databases_fingerprint()
+
+
+def _wait_stable_state(db: data_tools.SQLiteConnectionManager, state: tuple, debounce: float) -> tuple:
+    """Wait until database state doesn't change for debounce seconds"""
+    while debounce > 0:
+        time.sleep(debounce)
+        new_state = _databases_state(db)
+        if new_state == state:
+            break
+        logger.debug("database still changing, wait %ss more" % debounce)
+        state = new_state
+    return state
+
+
+def watch(publishers: list, force: bool = False, interval: float = None, debounce: float = None,
+          workers: int = None, timeout: float = None, **kwargs):
+    """Publish each time the database changes
+
+    Connection, compiled templates and publishers stay warm between
+    publications. Database state (PRAGMA data_version and file fingerprint)
+    is polled every interval seconds, a change is published once the state
+    has been stable for debounce seconds. When database files changed, the
+    connection is reopened first: a replaced file is only seen by a new
+    connection.
+
+    An error during an iteration (locked database, file missing while it is
+    replaced, ...) is logged and the change is published again at next poll,
+    as well as a change a publisher skipped because its previous update
+    timed out and is still running (see core.run_updates).
+    """
+    interval = interval if interval else config.getfloat('watch', 'interval', fallback=60)
+    debounce = debounce if debounce is not None else config.getfloat('watch', 'debounce', fallback=5)
+
+    instances = create_publishers(publishers)
+    db = data_tools.shared_connection()
+    last_state = None
+    logger.info("watching %s every %ss" % (', '.join(data_tools.sqlite_databases()), interval))
+    try:
+        while True:
+            try:
+                state = _databases_state(db)
+                if state != last_state:
+                    if last_state is not None:
+                        logger.debug("database changed")
+                        state = _wait_stable_state(db, state, debounce)
+                        if state[1] != last_state[1]:
+                            db.close()
+                            state = _databases_state(db)
+                    tracer.reset()
+                    data = load_data(sql_data=True, keep_connection=True)
+                    results = notify_publishers(data, instances, force=force, workers=workers, timeout=timeout)
+                    force = False
+                    if any(result.error == STILL_RUNNING for result in results):
+                        logger.warning("publishers still running: publish again at next poll")
+                        continue
+                    last_state = state
+            except Exception as err:
+                logger.error("Error while watching: %s" % err)
+                db.close()
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        logger.info("watch stopped")
+    finally:
+        data_tools.close_shared_connection()
+
+
+def compile_templates(target: str = None, **kwargs):
+    from mtpublishers.website import compile_templates as compile_website_templates
+    compile_website_templates(target)
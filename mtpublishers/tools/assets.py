@@ -0,0 +1,59 @@
+import os
+import hashlib
+import logging
+import functools
+from typing import Callable
+from mtpublishers import config
+import mtpublishers.tools.files as files_tools
+
+logger = logging.getLogger(__name__)
+
+_ASSETS_DIR = 'assets'
+
+_HEADERS = """/%(assets)s/*
+  Cache-Control: public, max-age=31536000, immutable
+/*.html
+  Cache-Control: public, max-age=0, must-revalidate
+/
+  Cache-Control: public, max-age=0, must-revalidate
+"""
+
+
+@functools.lru_cache(maxsize=None)
+def _publish_asset(source: str, mtime_ns: int, website_dir: str) -> str:
+    with open(source, 'rb') as asset:
+        content = asset.read()
+    stem, extension = os.path.splitext(os.path.basename(source))
+    relative = '%s/%s.%s%s' % (_ASSETS_DIR, stem, hashlib.sha256(content).hexdigest()[:12], extension)
+    files_tools.write_output(os.path.join(website_dir, relative), [content])
+    return relative
+
+
+def publish_asset(name: str, website_dir: str = None) -> str:
+    """Copy [directory] jinja/assets/NAME in website assets, content hash in its name
+
+    Hashed files never change: they can be cached forever (see
+    write_headers). Older versions are kept, archived pages still use them.
+
+    Returns:
+        str: asset path relative to website directory
+    """
+    website_dir = website_dir if website_dir else config.get('directory', 'website')
+    source = os.path.join(config.get('directory', 'jinja'), _ASSETS_DIR, name)
+    return _publish_asset(source, os.stat(source).st_mtime_ns, website_dir)
+
+
+def asset_url_function(page_dir: str, website_dir: str = None) -> Callable[[str], str]:
+    """asset_url(name) template function, urls are relative to page_dir"""
+    website_dir = website_dir if website_dir else config.get('directory', 'website')
+
+    def asset_url(name: str) -> str:
+        path = os.path.join(website_dir, publish_asset(name, website_dir))
+        return os.path.relpath(path, page_dir).replace(os.sep, '/')
+    return asset_url
+
+
+def write_headers(website_dir: str = None) -> bool:
+    """Write _headers file (Netlify, Cloudflare pages) with cache headers of assets and pages"""
+    website_dir = website_dir if website_dir else config.get('directory', 'website')
+    return files_tools.atomic_write(os.path.join(website_dir, '_headers'), [_HEADERS % {'assets': _ASSETS_DIR}])
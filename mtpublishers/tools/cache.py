@@ -0,0 +1,82 @@
+import os
+import glob
+import pickle
+import hashlib
+import logging
+from typing import List
+from mtpublishers import config
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCache():
+    """On-disk cache of query results
+
+    One entry per (sql texts, database fingerprint) key. Only the last
+    entry is kept: a new database state makes the previous one useless.
+    """
+
+    _PREFIX = 'queries-'
+    _SUFFIX = '.pickle'
+    _VERSION = 1
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    @classmethod
+    def from_config(cls):
+        """Cache configured in [cache] section, None if disabled"""
+        directory = config.get('directory', 'cache', fallback='')
+        if not directory or not config.getboolean('cache', 'queries', fallback=False):
+            return None
+        return cls(directory)
+
+    def key(self, sqls: List[str], fingerprint: str) -> str:
+        """Cache key of queries on a database state
+
+        Args:
+            sqls (List[str]): sql texts
+            fingerprint (str): database fingerprint, see data_tools.database_fingerprint
+
+        Returns:
+            str: key, None if fingerprint is unknown
+        """
+        if not fingerprint:
+            return None
+        hash_object = hashlib.sha1(('v%d' % self._VERSION).encode())
+        for sql in sqls:
+            hash_object.update(sql.encode())
+            hash_object.update(b'\0')
+        hash_object.update(fingerprint.encode())
+        return hash_object.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, '%s%s%s' % (self._PREFIX, key, self._SUFFIX))
+
+    def load(self, key: str):
+        if not key:
+            return None
+        try:
+            with open(self.path(key), 'rb') as cache_file:
+                payload = pickle.load(cache_file)
+        except FileNotFoundError:
+            return None
+        except Exception as err:
+            logger.debug("Unreadable query cache entry %s: %s" % (key, err))
+            return None
+        logger.debug("query cache hit: %s" % key)
+        return payload
+
+    def save(self, key: str, payload):
+        if not key:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        tmp_path = '%s.tmp' % path
+        with open(tmp_path, 'wb') as cache_file:
+            pickle.dump(payload, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        for old_entry in glob.glob(os.path.join(self.directory, '%s*%s' % (self._PREFIX, self._SUFFIX))):
+            if old_entry != path:
+                os.remove(old_entry)
+        logger.debug("query cache saved: %s" % key)
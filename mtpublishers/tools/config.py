@@ -14,6 +14,45 @@ PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 _CONFIG_FILE_NAME = 'mediastrends.%s.ini'
 
 
+class LazyConfig():
+    """Configuration resolved on first access
+
+    Proxy to the ConfigParser built by populate_config. Config files are
+    looked for only when a value is first read, or when populate is called.
+    """
+
+    def __init__(self, **populate_kwargs):
+        self._config = None
+        self._populate_kwargs = populate_kwargs
+
+    @property
+    def loaded(self):
+        return self._config is not None
+
+    def populate(self, user_dir_config=None, mode=None):
+        self._config = populate_config(init_config(), user_dir_config=user_dir_config, mode=mode, reload_=True)
+        return self
+
+    def resolve(self):
+        if self._config is None:
+            self._config = populate_config(init_config(), **self._populate_kwargs)
+        return self._config
+
+    def raw_sections(self) -> dict:
+        """Raw values of every section, see load_sections"""
+        config = self.resolve()
+        return {section: dict(config.items(section, raw=True)) for section in config.sections()}
+
+    def load_sections(self, sections: dict):
+        """Use raw values of raw_sections, e.g. in a spawned process"""
+        self._config = init_config()
+        self._config.read_dict(sections)
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+
 def init_config():
     config = configparser.ConfigParser(interpolation=ExtendedInterpolation())
 
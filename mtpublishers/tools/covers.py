@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import mimetypes
+import importlib
+import urllib.error
+import urllib.parse
+import urllib.request
+from abc import ABC, abstractmethod
+from mtpublishers import config
+import mtpublishers.tools.files as files_tools
+
+logger = logging.getLogger(__name__)
+
+# fetcher name -> "module:class"
+FETCHERS = {
+    'http': 'mtpublishers.tools.covers:HTTPCoverFetcher',
+    'directory': 'mtpublishers.tools.covers:DirectoryCoverFetcher',
+}
+
+
+class CoverFetcher(ABC):
+    """Fetch cover images, keeping a copy in a local cache directory
+
+    Subclasses only implement download. Covers are cached by url, a cover
+    that can't be fetched is None and is not cached. A cached cover older
+    than max_age seconds is downloaded again, the download may answer it
+    is not modified (None).
+    """
+
+    def __init__(self, cache_dir: str = None, max_age: float = None):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+
+    def cache_file(self, url: str) -> str:
+        extension = os.path.splitext(urllib.parse.urlparse(url).path)[1][:5]
+        return os.path.join(self.cache_dir, '%s%s' % (hashlib.sha1(url.encode()).hexdigest(), extension))
+
+    def fetch(self, url: str) -> bytes:
+        if not url:
+            return None
+        cache_file = self.cache_file(url) if self.cache_dir else None
+        cached = None
+        if cache_file and os.path.exists(cache_file):
+            with open(cache_file, 'rb') as cover:
+                cached = cover.read()
+            if self.max_age is None or time.time() - os.path.getmtime(cache_file) < self.max_age:
+                return cached
+        try:
+            content = self.download(url, cache_file if cached is not None else None)
+        except Exception as err:
+            logger.warning("Cover %s can't be fetched: %s" % (url, err))
+            return cached
+        if content is None:
+            logger.debug("cover %s not modified" % url)
+            os.utime(cache_file)
+            return cached
+        if content and cache_file:
+            files_tools.atomic_write(cache_file, [content])
+            os.utime(cache_file)
+        return content
+
+    @staticmethod
+    def mime_type(url: str) -> str:
+        return mimetypes.guess_type(urllib.parse.urlparse(url).path)[0] or 'image/jpeg'
+
+    @abstractmethod
+    def download(self, url: str, cache_file: str = None) -> bytes:
+        """Cover content, None if cache_file (cached copy to revalidate) is not modified"""
+        return
+
+
+class HTTPCoverFetcher(CoverFetcher):
+    """Covers are downloaded, cached ones are revalidated with conditional requests
+
+    ETag and Last-Modified of a response are kept in CACHE_FILE.headers.
+    """
+
+    def __init__(self, cache_dir: str = None, max_age: float = None, timeout: float = 10):
+        super().__init__(cache_dir, max_age)
+        self.timeout = timeout
+
+    def download(self, url: str, cache_file: str = None) -> bytes:
+        headers = {'User-Agent': 'mediastrends'}
+        validators = self.validators(cache_file) if cache_file else {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        request = urllib.request.Request(url, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                content = response.read()
+                validators = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+        except urllib.error.HTTPError as err:
+            if err.code == 304 and cache_file:
+                return None
+            raise
+        if self.cache_dir:
+            files_tools.atomic_write(self.validators_file(self.cache_file(url)), [json.dumps(validators)])
+        return content
+
+    @staticmethod
+    def validators_file(cache_file: str) -> str:
+        return '%s.headers' % cache_file
+
+    def validators(self, cache_file: str) -> dict:
+        try:
+            with open(self.validators_file(cache_file), 'r') as validators:
+                return json.load(validators)
+        except (OSError, ValueError):
+            return {}
+
+
+class DirectoryCoverFetcher(CoverFetcher):
+    """Covers are files of a local directory, named as the last part of their url"""
+
+    def __init__(self, cache_dir: str = None, max_age: float = None, directory: str = None):
+        super().__init__(cache_dir, max_age)
+        self.directory = directory
+
+    def download(self, url: str, cache_file: str = None) -> bytes:
+        name = os.path.basename(urllib.parse.urlparse(url).path)
+        with open(os.path.join(self.directory, name), 'rb') as cover:
+            return cover.read()
+
+
+def cover_fetcher(name: str = None) -> CoverFetcher:
+    """Fetcher of [cards] fetcher (name of FETCHERS or "module:class"), None if disabled"""
+    name = name if name is not None else config.get('cards', 'fetcher', fallback='http')
+    if not name:
+        return None
+    module_name, class_name = FETCHERS.get(name, name).split(':')
+    fetcher_class = getattr(importlib.import_module(module_name), class_name)
+    max_age = config.get('cards', 'covers_max_age', fallback='')
+    kwargs = {
+        'cache_dir': config.get('directory', 'covers_cache', fallback='') or None,
+        'max_age': float(max_age) if max_age else None
+    }
+    if issubclass(fetcher_class, DirectoryCoverFetcher):
+        kwargs['directory'] = config.get('cards', 'covers_dir', fallback='')
+    elif issubclass(fetcher_class, HTTPCoverFetcher):
+        kwargs['timeout'] = config.getfloat('cards', 'timeout', fallback=10)
+    return fetcher_class(**kwargs)
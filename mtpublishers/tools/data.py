@@ -2,23 +2,117 @@ import sqlite3
 import logging
 import random
 import os
+import re
+import glob
+import heapq
 import pathlib
-from typing import Callable, List
+import functools
+import zlib
+from types import MappingProxyType
+from typing import Callable, Iterable, Iterator, List
 from mtpublishers import config
 
 logger = logging.getLogger(__name__)
 
 
+ITEM_FIELDS = ('title', 'imdb_id', 'rating', 'year', 'cover_url',
+               'score', 'valid_date', 'genres', 'language_codes')
+_LIST_FIELDS = ('genres', 'language_codes')
+
+
+class MediaItem():
+    """Compact media item record
+
+    Slots based replacement of the plain dict items. It keeps the dict
+    interface (``get``, ``[]``, ``in``) so publishers and templates can use
+    both. Unset fields behave like missing keys.
+    """
+
+    __slots__ = ITEM_FIELDS + ('genres_emoji', 'langs_flag')
+
+    def __init__(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    @classmethod
+    def from_row(cls, plan: tuple, row: tuple):
+        item = cls()
+        for idx, field, split in plan:
+            value = row[idx]
+            if split and isinstance(value, str):
+                value = value.split(';')
+            setattr(item, field, value)
+        return item
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return [name for name in self.__slots__ if hasattr(self, name)]
+
+    def to_dict(self, fields: tuple = None):
+        fields = fields if fields else self.__slots__
+        return {name: getattr(self, name) for name in fields if hasattr(self, name)}
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key: str, value):
+        try:
+            setattr(self, key, value)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __contains__(self, key: str):
+        return hasattr(self, key)
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.to_dict())
+
+
+@functools.lru_cache(maxsize=32)
+def items_plan(description: tuple) -> tuple:
+    """Plan which cursor columns become item fields
+
+    Computed once per cursor description instead of once per row.
+
+    Args:
+        description (tuple): cursor.description
+
+    Returns:
+        tuple: (column index, field name, split on ';') for each kept column
+    """
+    return tuple(
+        (idx, col[0], col[0] in _LIST_FIELDS)
+        for idx, col in enumerate(description) if col[0] in ITEM_FIELDS
+    )
+
+
+def stream_items(cursor: sqlite3.Cursor) -> Iterator[MediaItem]:
+    """Stream rows of a cursor as MediaItem
+
+    Cursor must return plain tuples (no row factory).
+
+    Args:
+        cursor (Cursor): executed cursor
+
+    Yields:
+        MediaItem: one item per row
+    """
+    if cursor.description is None:
+        return
+    plan = items_plan(cursor.description)
+    for row in cursor:
+        yield MediaItem.from_row(plan, row)
+
+
 def items_factory(cursor, row):
     d = {}
-    fields = ['title', 'imdb_id', 'rating', 'year', 'cover_url',
-              'score', 'valid_date', 'genres', 'language_codes']
-    for idx, col in enumerate(cursor.description):
-        if col[0] in fields:
-            if col[0] in ['genres', 'language_codes']:
-                d[col[0]] = row[idx].split(';') if isinstance(row[idx], str) else row[idx]
-            else:
-                d[col[0]] = row[idx]
+    for idx, field, split in items_plan(cursor.description):
+        d[field] = row[idx].split(';') if split and isinstance(row[idx], str) else row[idx]
     return d
 
 
@@ -40,7 +134,7 @@ def connect_sqlite(database: str = None, factory: Callable = items_factory):
     Returns:
         Connection: connexion to db
     """
-    database = database if database else config.get('sqlite', 'path')
+    database = database if database else sqlite_databases()[0]
     try:
         con = sqlite3.connect(database)
         if factory:
@@ -52,6 +146,265 @@ def connect_sqlite(database: str = None, factory: Callable = items_factory):
     return con
 
 
+def sqlite_databases(paths: str = None) -> List[str]:
+    """Databases of [sqlite] path
+
+    Path holds one or several paths (one per line or comma separated),
+    each one can be a glob pattern. Patterns are expanded in sorted order,
+    a path without pattern is kept even if it doesn't exist.
+
+    Args:
+        paths (str, optional): paths. Defaults to None, [sqlite] path.
+
+    Returns:
+        List[str]: databases, duplicates removed
+    """
+    paths = paths if paths is not None else config.get('sqlite', 'path')
+    databases = []
+    for path in re.split(r'[\n,]+', paths):
+        path = path.strip()
+        if not path:
+            continue
+        if glob.has_magic(path):
+            databases += sorted(glob.glob(path))
+        else:
+            databases.append(path)
+    databases = list(dict.fromkeys(databases))
+    if not databases:
+        raise ValueError("No sqlite database matches [sqlite] path: %s" % paths)
+    return databases
+
+
+_PRAGMAS = ('mmap_size', 'cache_size', 'temp_store', 'query_only')
+_PRAGMA_VALUE = re.compile(r'^-?\w+$')
+
+
+def sqlite_pragmas() -> dict:
+    """Pragmas set in [sqlite] config section
+
+    Returns:
+        dict: pragma name -> value, empty values are skipped
+    """
+    pragmas = {}
+    for name in _PRAGMAS:
+        value = config.get('sqlite', name, fallback='').strip()
+        if not value:
+            continue
+        if not _PRAGMA_VALUE.match(value):
+            raise ValueError("Invalid value for sqlite pragma %s: %s" % (name, value))
+        pragmas[name] = value
+    return pragmas
+
+
+class SQLiteConnectionManager():
+    """Single sqlite connection shared by every query of a run
+
+    The connection is opened lazily, read-only (mode=ro uri) by default,
+    and tuned with pragmas from [sqlite] config section. Row factories are
+    cursor settings, see execute.
+    """
+
+    def __init__(self, database: str = None, read_only: bool = None, pragmas: dict = None):
+        self.database = database if database else sqlite_databases()[0]
+        self.read_only = read_only if read_only is not None else config.getboolean('sqlite', 'read_only', fallback=True)
+        self.pragmas = pragmas if pragmas is not None else sqlite_pragmas()
+        self._connection = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = self.open()
+        return self._connection
+
+    def open(self) -> sqlite3.Connection:
+        try:
+            if self.read_only:
+                uri = "%s?mode=ro" % pathlib.Path(self.database).resolve().as_uri()
+                con = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            else:
+                con = sqlite3.connect(self.database, check_same_thread=False)
+            for name, value in self.pragmas.items():
+                con.execute("PRAGMA %s = %s" % (name, value))
+        except sqlite3.OperationalError as err:
+            logger.error("Error while getting connection to sqlite db: %s" % err)
+            raise err
+        logger.debug("sqlite connection opened on %s (read_only=%s)" % (self.database, self.read_only))
+        return con
+
+    def execute(self, sql: str, parameters=(), factory: Callable = None) -> sqlite3.Cursor:
+        """Execute sql on a new cursor of the shared connection
+
+        Args:
+            sql (str): query
+            parameters (optional): query parameters
+            factory (Callable, optional): row factory of this cursor only. Defaults to None (tuples).
+
+        Returns:
+            Cursor: executed cursor
+        """
+        cursor = self.connection.cursor()
+        cursor.row_factory = factory
+        return cursor.execute(sql, parameters)
+
+    def state(self) -> tuple:
+        """Cheap database state, changes when data is modified
+
+        PRAGMA data_version of this connection catches commits of other
+        connections, file fingerprint catches a replaced database file. The
+        connection still reads a replaced file until it is closed.
+        """
+        data_version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+        return data_version, database_fingerprint(self.database)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+_shared_manager = None
+
+
+def shared_connection() -> SQLiteConnectionManager:
+    """Connection manager shared during the run, created on first call"""
+    global _shared_manager
+    if _shared_manager is None:
+        _shared_manager = SQLiteConnectionManager()
+    return _shared_manager
+
+
+def close_shared_connection():
+    global _shared_manager
+    if _shared_manager is not None:
+        _shared_manager.close()
+        _shared_manager = None
+
+
+def database_fingerprint(database: str = None) -> str:
+    """Cheap fingerprint of sqlite database state
+
+    Inode, size and modification time of the database file and of its WAL
+    file.
+    PRAGMA data_version can't be used here: it is only comparable within
+    a single connection.
+
+    Args:
+        database (str, optional): path to sqlite database. Defaults to None.
+
+        If None, use config sqlite path paramater.
+
+    Returns:
+        str: fingerprint, None if database does not exist
+    """
+    database = database if database else sqlite_databases()[0]
+    parts = []
+    for path in [database, database + '-wal']:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            if path == database:
+                return None
+            continue
+        parts.append("%s:%d:%d:%d" % (os.path.basename(path), stat.st_ino, stat.st_size, stat.st_mtime_ns))
+    return '|'.join(parts)
+
+
+def databases_fingerprint(databases: List[str] = None) -> str:
+    """Fingerprint of several databases, None if one does not exist"""
+    databases = databases if databases else sqlite_databases()
+    fingerprints = [database_fingerprint(database) for database in databases]
+    if None in fingerprints:
+        return None
+    return '||'.join(fingerprints)
+
+
+def _merge_key(item: MediaItem) -> str:
+    imdb_id = item.get('imdb_id')
+    return '' if imdb_id is None else str(imdb_id)
+
+
+def sorted_items(database: str, sql: str, batch_size: int = 1000) -> Iterator[MediaItem]:
+    """Stream items of sql on database, ordered on imdb_id
+
+    Query runs on its own read-only connection when the first item is
+    requested, rows are then fetched batch_size at a time. Connection is
+    closed when the stream is exhausted or closed.
+    """
+    sql = 'SELECT * FROM (%s) ORDER BY CAST(imdb_id AS TEXT)' % sql.strip().rstrip(';')
+    with SQLiteConnectionManager(database) as db:
+        cursor = db.execute(sql)
+        plan = items_plan(cursor.description)
+        rows = cursor.fetchmany(batch_size)
+        while rows:
+            for row in rows:
+                yield MediaItem.from_row(plan, row)
+            rows = cursor.fetchmany(batch_size)
+
+
+def _aggregate_mean(scores: List[float]) -> float:
+    return sum(scores) / len(scores)
+
+
+SCORE_AGGREGATIONS = MappingProxyType({
+    'max': max,
+    'min': min,
+    'sum': sum,
+    'mean': _aggregate_mean,
+    'first': lambda scores: scores[0]
+})
+
+
+def merge_items(streams: List[Iterable[MediaItem]], aggregation: str = 'max') -> Iterator[MediaItem]:
+    """Merge item streams ordered on imdb_id, one item per imdb_id
+
+    Streams are merged lazily: only the items of the current imdb_id are
+    held. Fields come from the first stream holding the id, except score
+    (aggregated over every stream), valid_date (latest) and list fields
+    (union). Items without imdb_id are not merged.
+
+    Args:
+        streams (List[Iterable[MediaItem]]): streams sorted on imdb_id, see sorted_items
+        aggregation (str, optional): score aggregation, key of SCORE_AGGREGATIONS. Defaults to 'max'.
+
+    Yields:
+        MediaItem: merged items, ordered on imdb_id
+    """
+    if aggregation not in SCORE_AGGREGATIONS:
+        raise ValueError("Unknown score aggregation %s (expected one of %s)" % (aggregation, ', '.join(SCORE_AGGREGATIONS)))
+    aggregate = SCORE_AGGREGATIONS[aggregation]
+    group = []
+    for item in heapq.merge(*streams, key=_merge_key):
+        if group and (_merge_key(item) != _merge_key(group[0]) or not _merge_key(item)):
+            yield _merge_group(group, aggregate)
+            group = []
+        group.append(item)
+    if group:
+        yield _merge_group(group, aggregate)
+
+
+def _merge_group(group: List[MediaItem], aggregate: Callable) -> MediaItem:
+    item = group[0]
+    if len(group) == 1:
+        return item
+    scores = [other.get('score') for other in group if other.get('score') is not None]
+    if scores:
+        item['score'] = aggregate(scores)
+    dates = [other.get('valid_date') for other in group if other.get('valid_date') is not None]
+    if dates:
+        item['valid_date'] = max(dates, key=str)
+    for field in _LIST_FIELDS:
+        values = [value for other in group for value in (other.get(field) or [])]
+        if values:
+            item[field] = list(dict.fromkeys(values))
+    return item
+
+
 def read_sql(resource: str) -> str:
     """Read sql resource
 
@@ -84,70 +437,120 @@ def read_sql(resource: str) -> str:
     return sql
 
 
-def add_emojis_genre(genres: List[str]):
-    emojis = []
+GENRE_EMOJIS = MappingProxyType({
+    'action': ('em-racing_car', 'em-female_superhero', 'em-male_superhero', 'em-boom', 'em-fire'),
+    'adult': ('em-eggplant', 'em-peach', 'em-underage'),
+    'adventure': ('em-world_map', 'em-mountain_railway', 'em-mag', 'em-railway_track'),
+    'animation': ('em-teddy_bear', 'em-child'),
+    'biography': ('em-book', 'em-bearded_person', 'em-lower_left_fountain_pen'),
+    'comedy': ('em-face_with_hand_over_mouth', 'em-laughing', 'em-smile'),
+    'crime': ('em-dagger_knife', 'em-female-detective', 'em-male-detective'),
+    'documentary': ('em-national_park', 'em-elephant', 'em-film_projector'),
+    'drama': ('em-cry', 'em-disappointed_relieved', 'em-anguished', 'em-confounded'),
+    'family': ('em-family', 'em-woman-woman-girl-boy', 'em-man-man-girl-boy', 'em-man-woman-girl-boy'),
+    'fantasy': ('em-male_mage', 'em-female_mage', 'em-dragon', 'em-unicorn_face'),
+    'film-noir': ('em-black_circle', 'em-black_large_square'),
+    'game-show': ('em-game_die',),
+    'history': ('em-moyai', 'em-mantelpiece_clock'),
+    'horror': ('em-scream', 'em-male_zombie', 'em-female_zombie', 'em-fearful', 'em-scream_cat'),
+    'musical': ('em-notes', 'em-musical_keyboard', 'em-microphone'),
+    'music': ('em-notes', 'em-musical_keyboard', 'em-microphone'),
+    'mystery': ('em-shushing_face', 'em-zipper_mouth_face'),
+    'news': ('em-newspaper', 'em-rolled_up_newspaper'),
+    'reality-tv': ('em-tv',),
+    'romance': ('em-two_hearts', 'em-woman-heart-man', 'em-woman-heart-woman', 'em-man-heart-man'),
+    'sci-fi': ('em-alien', 'em-space_invader', 'em-spock-hand'),
+    'short': None,
+    'sport': ('em-baseball', 'em-football', 'em-swimmer', 'em-woman-biking', 'em-weight_lifter', 'em-soccer'),
+    'talk-show': ('em-speaking_head_in_silhouette',),
+    'thriller': ('em-cold_face', 'em-exploding_head'),
+    'war': ('em-bomb', 'em-crossed_swords'),
+    'western': ('em-desert', 'em-face_with_cowboy_hat', 'em-racehorse', 'em-cactus'),
+})
 
-    if not genres:
-        return emojis
-
-    transform_genre = {
-        'action': ['em-racing_car', 'em-female_superhero', 'em-male_superhero', 'em-boom', 'em-fire'],
-        'adult': ['em-eggplant', 'em-peach', 'em-underage'],
-        'adventure': ['em-world_map', 'em-mountain_railway', 'em-mag', 'em-railway_track'],
-        'animation': ['em-teddy_bear', 'em-child'],
-        'biography': ['em-book', 'em-bearded_person', 'em-lower_left_fountain_pen'],
-        'comedy': ['em-face_with_hand_over_mouth', 'em-laughing', 'em-smile'],
-        'crime': ['em-dagger_knife', 'em-female-detective', 'em-male-detective'],
-        'documentary': ['em-national_park', 'em-elephant', 'em-film_projector'],
-        'drama': ['em-cry', 'em-disappointed_relieved', 'em-anguished', 'em-confounded'],
-        'family': ['em-family', 'em-woman-woman-girl-boy', 'em-man-man-girl-boy', 'em-man-woman-girl-boy'],
-        'fantasy': ['em-male_mage', 'em-female_mage', 'em-dragon', 'em-unicorn_face'],
-        'film-noir': ['em-black_circle', 'em-black_large_square'],
-        'game-show': ['em-game_die'],
-        'history': ['em-moyai', 'em-mantelpiece_clock'],
-        'horror': ['em-scream', 'em-male_zombie', 'em-female_zombie', 'em-fearful', 'em-scream_cat'],
-        'musical': ['em-notes', 'em-musical_keyboard', 'em-microphone'],
-        'music': ['em-notes', 'em-musical_keyboard', 'em-microphone'],
-        'mystery': ['em-shushing_face', 'em-zipper_mouth_face'],
-        'news': ['em-newspaper', 'em-rolled_up_newspaper'],
-        'reality-tv': ['em-tv'],
-        'romance': ['em-two_hearts', 'em-woman-heart-man', 'em-woman-heart-woman', 'em-man-heart-man'],
-        'sci-fi': ['em-alien', 'em-space_invader', 'em-spock-hand'],
-        'short': None,
-        'sport': ['em-baseball', 'em-football', 'em-swimmer', 'em-woman-biking', 'em-weight_lifter', 'em-soccer'],
-        'talk-show': ['em-speaking_head_in_silhouette'],
-        'thriller': ['em-cold_face', 'em-exploding_head'],
-        'war': ['em-bomb', 'em-crossed_swords'],
-        'western': ['em-desert', 'em-face_with_cowboy_hat', 'em-racehorse', 'em-cactus'],
-    }
+LANGUAGE_FLAGS = MappingProxyType({
+    'en': 'gb', 'cmn': 'cn', 'hi': 'in', 'ja': 'jp', 'yue': 'cn', 'da': 'dk', 'ko': 'kr', 'el': 'gr', 'ny': 'mw'
+})
+_SKIPPED_LANGUAGES = frozenset(['haw', 'zxx'])
+_SHORT_FLAGS = frozenset(['fr', 'gb', 'kr', 'jp', 'it', 'us', 'cn', 'de', 'es'])
 
+
+@functools.lru_cache(maxsize=1024)
+def _genres_emojis_choices(genres: tuple) -> tuple:
+    """(genre, emojis choices) of known genres, cached per genres combination"""
+    choices = []
     for genre in genres:
         genre = genre.lower()
-        if genre not in transform_genre:
+        if not GENRE_EMOJIS.get(genre):
             continue
-        if not transform_genre.get(genre):
+        choices.append((genre, GENRE_EMOJIS[genre]))
+    return tuple(choices)
+
+
+@functools.lru_cache(maxsize=1024)
+def _languages_flags(language_codes: tuple) -> tuple:
+    """Flags of language codes, cached per language codes combination"""
+    flags = []
+    for lang in language_codes:
+        lang = lang.lower()
+        if lang in _SKIPPED_LANGUAGES:
             continue
-        em = random.choice(transform_genre.get(genre))
+        lang = LANGUAGE_FLAGS.get(lang, lang)
+        if lang in _SHORT_FLAGS:
+            flags.append('em-%s' % lang)
+        else:
+            flags.append('em-flag-%s' % lang)
+    return tuple(flags)
+
+
+def add_emojis_genre(genres: List[str], seed: str = None):
+    """Pick one emoji per known genre
+
+    Args:
+        genres (List[str]): genres
+        seed (str, optional): when given (e.g. imdb_id) picks are deterministic. Defaults to None (random).
+
+    Returns:
+        list: [{'genre': str, 'emoji': str}, ...]
+    """
+    if not genres:
+        return []
+
+    emojis = []
+    for genre, choices in _genres_emojis_choices(tuple(genres)):
+        if seed is None:
+            em = random.choice(choices)
+        else:
+            em = choices[zlib.crc32(('%s:%s' % (seed, genre)).encode()) % len(choices)]
         emojis.append({'genre': genre, 'emoji': em})
     return emojis
 
 
 def add_emojis_language(language_codes: List[str]):
-    emojis = []
-    transform_flag = {'en': 'gb', 'cmn': 'cn', 'hi': 'in', 'ja': 'jp',
-                      'yue': 'cn', 'da': 'dk', 'ko': 'kr', 'el': 'gr',
-                      'ny': 'mw'}
-    pass_flags = ['haw', 'zxx']
     if not language_codes:
-        return emojis
+        return []
+    return list(_languages_flags(tuple(language_codes)))
 
-    for lang in language_codes:
-        lang = lang.lower()
-        if lang in pass_flags:
-            continue
-        lang = transform_flag.get(lang, lang)
-        if lang in ['fr', 'gb', 'kr', 'jp', 'it', 'us', 'cn', 'de', 'es']:
-            emojis.append('em-%s' % lang)
-        else:
-            emojis.append('em-flag-%s' % lang)
-    return emojis
+
+def enrich_items(items: Iterable[dict], deterministic: bool = None) -> Iterator[dict]:
+    """Add genres emojis and languages flags to items
+
+    Works on a whole batch (or stream) of items: config is read once and
+    genres/languages combinations are shared between items.
+
+    Args:
+        items (Iterable[dict]): items or MediaItem, enriched in place
+        deterministic (bool, optional): emojis picked from imdb_id instead of randomly.
+            Defaults to [emojis] deterministic, always on with [build] reproducible.
+
+    Yields:
+        dict: enriched item
+    """
+    if deterministic is None:
+        deterministic = config.getboolean('emojis', 'deterministic', fallback=False) \
+            or config.getboolean('build', 'reproducible', fallback=False)
+    for item in items:
+        seed = str(item.get('imdb_id')) if deterministic else None
+        item['genres_emoji'] = add_emojis_genre(item.get('genres'), seed)
+        item['langs_flag'] = add_emojis_language(item.get('language_codes'))
+        yield item
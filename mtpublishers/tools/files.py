@@ -0,0 +1,140 @@
+import os
+import gzip
+import hashlib
+import functools
+import tempfile
+import logging
+from typing import Callable, Dict, Iterable, Union
+from mtpublishers import config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 1 << 16
+_COMPRESSIBLE = frozenset(['.html', '.css', '.js', '.json', '.svg', '.xml', '.rss', '.atom', '.txt'])
+
+# process umask, read once: os.umask can only be read by setting it, which
+# would briefly give other threads' files a 0 umask
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def file_digest(path: str) -> str:
+    """sha1 of a file content, None if file does not exist"""
+    digest = hashlib.sha1()
+    try:
+        with open(path, 'rb') as file_:
+            for chunk in iter(lambda: file_.read(_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+def atomic_write(path: str, chunks: Iterable[Union[str, bytes]], encoding: str = 'utf-8') -> bool:
+    """Stream chunks to a file, atomically and only if content changed
+
+    Chunks go to a temporary file of the same directory while their digest
+    is computed. The temporary file replaces path only when its content
+    differs, so readers never see a half written file and unchanged files
+    keep their mtime.
+
+    Args:
+        path (str): destination file
+        chunks (Iterable[Union[str, bytes]]): content, str chunks are encoded
+        encoding (str, optional): encoding of str chunks. Defaults to 'utf-8'.
+
+    Returns:
+        bool: True if path was written
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha1()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.%s.' % os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode(encoding)
+                digest.update(chunk)
+                size += len(chunk)
+                tmp_file.write(chunk)
+
+        if os.path.exists(path) and os.path.getsize(path) == size and file_digest(path) == digest.hexdigest():
+            logger.debug("%s is unchanged" % path)
+            os.remove(tmp_path)
+            return False
+
+        os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    logger.debug("%s written (%d bytes)" % (path, size))
+    return True
+
+
+def _gzip(content: bytes) -> bytes:
+    # mtime=0 and no file name: same content, same bytes
+    return gzip.compress(content, compresslevel=9, mtime=0)
+
+
+@functools.lru_cache(maxsize=None)
+def _warn_no_brotli():
+    logger.warning("brotli module is not installed: no .br files are written, install mtpublishers[brotli]")
+
+
+def compressors() -> Dict[str, Callable]:
+    """Extension -> compression of precompressed siblings, .br only with brotli module"""
+    methods = {'.gz': _gzip}
+    if brotli is not None:
+        methods['.br'] = lambda content: brotli.compress(content, quality=11)
+    else:
+        _warn_no_brotli()
+    return methods
+
+
+def precompress(path: str, force: bool = False) -> int:
+    """Write compressed siblings of path (index.html.gz, index.html.br, ...)
+
+    Siblings are written when force or when missing.
+
+    Returns:
+        int: number of siblings written
+    """
+    if os.path.splitext(path)[1] not in _COMPRESSIBLE:
+        return 0
+    methods = {extension: method for extension, method in compressors().items()
+               if force or not os.path.exists(path + extension)}
+    if not methods:
+        return 0
+    with open(path, 'rb') as file_:
+        content = file_.read()
+    written = 0
+    for extension, method in methods.items():
+        written += atomic_write(path + extension, [method(content)])
+    return written
+
+
+def write_output(path: str, chunks: Iterable[Union[str, bytes]], encoding: str = 'utf-8') -> bool:
+    """Write a published file, see atomic_write
+
+    With [build] precompress, compressed siblings are kept up to date.
+    """
+    changed = atomic_write(path, chunks, encoding=encoding)
+    if config.getboolean('build', 'precompress', fallback=False):
+        precompress(path, force=changed)
+    return changed
+
+
+def remove_output(path: str):
+    """Remove a published file and its compressed siblings"""
+    for sibling in [path] + [path + extension for extension in ('.gz', '.br')]:
+        if os.path.exists(sibling):
+            os.remove(sibling)
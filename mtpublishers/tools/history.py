@@ -0,0 +1,195 @@
+import os
+import pickle
+import struct
+import difflib
+import logging
+from typing import Dict, Iterator, List
+import mtpublishers.tools.files as files_tools
+
+logger = logging.getLogger(__name__)
+
+_VERSION = 2
+# record length
+_RECORD = struct.Struct('>I')
+
+
+def _empty_state(fields: tuple) -> dict:
+    return {'version': _VERSION, 'offset': 0, 'fields': tuple(fields), 'snapshots': [], 'informations': {}, 'categories': {}}
+
+
+def order_delta(previous: List[str], order: List[str]) -> list:
+    """Order as operations on previous order
+
+    Each operation is either a (start, end) slice of previous order or a
+    list of keys. An order far from the previous one is a single list.
+    """
+    operations = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, previous, order, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            operations.append((i1, i2))
+        elif j2 > j1:
+            operations.append(order[j1:j2])
+    return operations if len(operations) < len(order) else [list(order)]
+
+
+def apply_order_delta(previous: List[str], operations: list) -> List[str]:
+    order = []
+    for operation in operations:
+        order.extend(previous[operation[0]:operation[1]] if isinstance(operation, tuple) else operation)
+    return order
+
+
+class ArchiveStore():
+    """Append-only store of successive snapshots, delta encoded
+
+    Each record holds, per category, the items added or changed since the
+    previous snapshot, the ids removed, and the changes of items order
+    (see order_delta). Records are appended to the store file and never
+    rewritten. Records of other fields are read as the store fields.
+
+    Latest full state is kept in a checkpoint file next to the store, so
+    appending a snapshot costs the size of the snapshot, not the length of
+    the history. The checkpoint is rebuilt from the records when it doesn't
+    match the store (e.g. after a crash between both writes).
+    """
+
+    def __init__(self, path: str, fields: tuple):
+        self.path = path
+        self.fields = tuple(fields)
+        self._state = None
+
+    @property
+    def checkpoint_file(self) -> str:
+        return '%s.checkpoint' % self.path
+
+    @property
+    def state(self) -> dict:
+        if self._state is None:
+            self._state = self.load_state()
+        return self._state
+
+    @property
+    def snapshots(self) -> List[dict]:
+        """Archived snapshots: name, hash and items count of each"""
+        return self.state['snapshots']
+
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def load_state(self) -> dict:
+        try:
+            with open(self.checkpoint_file, 'rb') as checkpoint:
+                state = pickle.load(checkpoint)
+            if state.get('version') == _VERSION and state['offset'] == self.size() and state['fields'] == self.fields:
+                return state
+        except (FileNotFoundError, pickle.UnpicklingError, EOFError, KeyError):
+            pass
+        if self.size():
+            logger.info("archive checkpoint outdated: replay %s" % self.path)
+        state = _empty_state(self.fields)
+        for record in self.records():
+            self._apply(state, record)
+        if state['offset']:
+            files_tools.atomic_write(self.checkpoint_file, [pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)])
+        return state
+
+    def records(self) -> Iterator[dict]:
+        """Records of the store, oldest first"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as store:
+            while True:
+                header = store.read(_RECORD.size)
+                if len(header) < _RECORD.size:
+                    break
+                length = _RECORD.unpack(header)[0]
+                payload = store.read(length)
+                if len(payload) < length:
+                    logger.warning("truncated record at the end of %s ignored" % self.path)
+                    break
+                record = pickle.loads(payload)
+                record['_offset'] = store.tell()
+                yield record
+
+    def _apply(self, state: dict, record: dict):
+        for cat_name, delta in record['categories'].items():
+            category = state['categories'].setdefault(cat_name, {'items': {}, 'order': []})
+            for key in delta['removed']:
+                category['items'].pop(key, None)
+            changed = delta['changed']
+            if record['fields'] != state['fields']:
+                changed = {key: tuple(dict(zip(record['fields'], values)).get(f) for f in state['fields'])
+                           for key, values in changed.items()}
+            category['items'].update(changed)
+            if delta['order'] is not None:
+                # version 1 records hold the whole order
+                category['order'] = delta['order'] if record.get('version', 1) < 2 \
+                    else apply_order_delta(category['order'], delta['order'])
+        for cat_name in record.get('dropped', []):
+            state['categories'].pop(cat_name, None)
+        if record['informations'] is not None:
+            state['informations'] = record['informations']
+        state['snapshots'].append(record['snapshot'])
+        state['offset'] = record['_offset']
+
+    def delta(self, categories: Dict[str, Dict[str, tuple]]) -> dict:
+        """Changes of categories (category -> key -> item fields, in order) since last snapshot"""
+        deltas = {}
+        for cat_name, items in categories.items():
+            previous = self.state['categories'].get(cat_name, {'items': {}, 'order': []})
+            changed = {key: values for key, values in items.items() if previous['items'].get(key) != values}
+            removed = [key for key in previous['items'] if key not in items]
+            order = list(items)
+            deltas[cat_name] = {
+                'changed': changed,
+                'removed': removed,
+                'order': order_delta(previous['order'], order) if order != previous['order'] else None
+            }
+        return deltas
+
+    def append(self, snapshot: dict, informations: dict, categories: Dict[str, Dict[str, tuple]]) -> dict:
+        """Append a snapshot
+
+        Args:
+            snapshot (dict): snapshot description (name, hash, ...)
+            informations (dict): mediastrends informations
+            categories (Dict[str, Dict[str, tuple]]): category -> item key -> item fields, in order
+
+        Returns:
+            dict: appended record
+        """
+        deltas = self.delta(categories)
+        snapshot = dict(snapshot)
+        snapshot['items'] = sum(len(items) for items in categories.values())
+        snapshot['changed'] = sum(len(delta['changed']) + len(delta['removed']) for delta in deltas.values())
+        record = {
+            'version': _VERSION,
+            'fields': self.fields,
+            'snapshot': snapshot,
+            'informations': informations if informations != self.state['informations'] else None,
+            'categories': {cat_name: delta for cat_name, delta in deltas.items()
+                           if delta['changed'] or delta['removed'] or delta['order'] is not None},
+            'dropped': [cat_name for cat_name in self.state['categories'] if cat_name not in categories]
+        }
+        payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        if self.size() > self.state['offset']:
+            logger.warning("incomplete record at the end of %s removed" % self.path)
+            os.truncate(self.path, self.state['offset'])
+        with open(self.path, 'ab') as store:
+            store.write(_RECORD.pack(len(payload)) + payload)
+            store.flush()
+            os.fsync(store.fileno())
+            record['_offset'] = store.tell()
+        self._apply(self.state, record)
+        files_tools.atomic_write(self.checkpoint_file, [pickle.dumps(self.state, protocol=pickle.HIGHEST_PROTOCOL)])
+        logger.debug("snapshot %s archived: %d bytes, %d changes" % (snapshot.get('name'), len(payload), snapshot['changed']))
+        return record
+
+    def items(self, cat_name: str) -> List[dict]:
+        """Items of a category in latest snapshot, in order"""
+        category = self.state['categories'].get(cat_name, {'items': {}, 'order': []})
+        return [dict(zip(self.fields, category['items'][key])) for key in category['order']]
@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+from typing import List
+from mtpublishers import config
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox():
+    """Durable publication jobs, one per (data hash, publisher)
+
+    Jobs live in a small sqlite database. A failed publication stays
+    pending with an exponential backoff and is retried from its payload, a
+    snapshot of the data saved when it first failed. A job succeeding
+    supersedes pending jobs of older data for the same publisher.
+    """
+
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    SUPERSEDED = 'superseded'
+
+    _SCHEMA = """CREATE TABLE IF NOT EXISTS jobs (
+        data_hash TEXT NOT NULL,
+        publisher TEXT NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt REAL,
+        payload TEXT,
+        categories TEXT,
+        last_error TEXT,
+        created REAL NOT NULL,
+        updated REAL NOT NULL,
+        PRIMARY KEY (data_hash, publisher)
+    )"""
+
+    def __init__(self, path: str, max_attempts: int = 5, backoff: float = 60):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path)
+        self._connection.row_factory = sqlite3.Row
+        with self._connection:
+            self._connection.execute(self._SCHEMA)
+
+    @classmethod
+    def from_config(cls):
+        """Outbox of [outbox] section, None if disabled
+
+        Database defaults to outbox.db next to [hash] file.
+        """
+        if not config.getboolean('outbox', 'enabled', fallback=False):
+            return None
+        path = config.get('outbox', 'path', fallback='')
+        if not path:
+            hash_file = config.get('hash', 'file', fallback='')
+            if not hash_file:
+                return None
+            path = os.path.join(os.path.dirname(os.path.abspath(hash_file)), 'outbox.db')
+        return cls(path,
+                   max_attempts=config.getint('outbox', 'max_attempts', fallback=5),
+                   backoff=config.getfloat('outbox', 'backoff', fallback=60))
+
+    @staticmethod
+    def publisher_id(publisher) -> str:
+        """Importable path of publisher class, see tasks.load_publisher"""
+        return '%s:%s' % (type(publisher).__module__, type(publisher).__name__)
+
+    def payload_file(self, data_hash: str) -> str:
+        return os.path.join(os.path.dirname(os.path.abspath(self.path)), 'outbox', '%s.mts' % data_hash)
+
+    def jobs(self, data_hash: str) -> dict:
+        """publisher id -> job of data_hash"""
+        rows = self._connection.execute("SELECT * FROM jobs WHERE data_hash = ?", (data_hash,))
+        return {row['publisher']: dict(row) for row in rows}
+
+    def due_jobs(self, now: float = None) -> List[dict]:
+        """Pending jobs to retry now, only the most recent one per publisher"""
+        now = now if now is not None else time.time()
+        rows = self._connection.execute(
+            "SELECT * FROM jobs WHERE status = ? ORDER BY created DESC", (self.PENDING,))
+        jobs = {}
+        for row in rows:
+            if row['publisher'] not in jobs:
+                jobs[row['publisher']] = dict(row)
+        return [job for job in jobs.values() if job['next_attempt'] is None or job['next_attempt'] <= now]
+
+    def all_done(self, data_hash: str, publishers: List[str] = None) -> bool:
+        """True when every publisher (default: every one with a job of data_hash) is done with it"""
+        jobs = self.jobs(data_hash)
+        publishers = publishers if publishers is not None else list(jobs)
+        return all(publisher in jobs and jobs[publisher]['status'] == self.DONE for publisher in publishers)
+
+    def latest_hash(self) -> str:
+        """Data hash of the most recent job, None if there is no job"""
+        row = self._connection.execute("SELECT data_hash FROM jobs ORDER BY created DESC LIMIT 1").fetchone()
+        return row['data_hash'] if row else None
+
+    def record(self, data_hash: str, publisher: str, success: bool, error: str = None,
+               payload: str = None, categories: List[str] = None):
+        """Record an attempt of publisher to publish data_hash"""
+        now = time.time()
+        job = self.jobs(data_hash).get(publisher)
+        attempts = (job['attempts'] if job else 0) + 1
+        if success:
+            status, next_attempt = self.DONE, None
+        elif attempts >= self.max_attempts:
+            status, next_attempt = self.FAILED, None
+            logger.error("%s gave up publishing %s after %d attempts" % (publisher, data_hash, attempts))
+        else:
+            status, next_attempt = self.PENDING, now + self.backoff * 2 ** (attempts - 1)
+        with self._connection:
+            self._connection.execute("""INSERT OR REPLACE INTO jobs
+                (data_hash, publisher, status, attempts, next_attempt, payload, categories, last_error, created, updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", (
+                data_hash, publisher, status, attempts, next_attempt,
+                payload if payload else (job['payload'] if job else None),
+                json.dumps(sorted(categories)) if categories is not None else (job['categories'] if job else None),
+                error, job['created'] if job else now, now))
+            if success:
+                self._connection.execute(
+                    "UPDATE jobs SET status = ?, updated = ? WHERE publisher = ? AND status = ? AND created < ?",
+                    (self.SUPERSEDED, now, publisher, self.PENDING, job['created'] if job else now))
+
+    def prune_payloads(self):
+        """Remove payloads no pending job needs anymore, once per run"""
+        needed = set(row['payload'] for row in self._connection.execute(
+            "SELECT DISTINCT payload FROM jobs WHERE status = ? AND payload IS NOT NULL", (self.PENDING,)))
+        payload_dir = os.path.dirname(self.payload_file('x'))
+        if not os.path.isdir(payload_dir):
+            return
+        for name in os.listdir(payload_dir):
+            payload = os.path.join(payload_dir, name)
+            if payload not in needed:
+                os.remove(payload)
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,106 @@
+import json
+import time
+import cProfile
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable
+import mtpublishers.tools.files as files_tools
+
+logger = logging.getLogger(__name__)
+
+
+class Tracer():
+    """Collect timed spans of a run
+
+    Spans can be opened from several threads. Each span records its start
+    (relative to tracer start), duration and attributes such as rows or
+    bytes written. Spans of other processes are merged with their tracer
+    origin, see merge.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._origin = time.perf_counter()
+            self._wall_origin = time.time()
+            self._started_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+            self.spans = []
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Time a block of code
+
+        Yields attributes dict, the block can add its own (rows, bytes, ...).
+        """
+        start = time.perf_counter()
+        error = None
+        try:
+            yield attributes
+        except BaseException as err:
+            error = repr(err)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            span = {
+                'name': name,
+                'start': start - self._origin,
+                'elapsed': elapsed,
+                'thread': threading.current_thread().name,
+                'attributes': attributes
+            }
+            if error:
+                span['error'] = error
+            with self._lock:
+                self.spans.append(span)
+            logger.debug("span %s: %.3fs %s" % (name, elapsed, attributes if attributes else ''))
+
+    @property
+    def origin(self) -> float:
+        """Wall clock time of tracer start, to merge its spans in another process tracer"""
+        return self._wall_origin
+
+    def merge(self, spans: list, origin: float = None):
+        """Add spans recorded by another process
+
+        Args:
+            spans (list): spans of the other process tracer
+            origin (float, optional): origin of that tracer: spans are moved
+                to this tracer timeline. Defaults to None, same origin (e.g. forked process).
+        """
+        offset = origin - self._wall_origin if origin is not None else 0
+        with self._lock:
+            self.spans.extend(dict(span, start=span['start'] + offset) for span in spans)
+
+    def report(self) -> dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span['start'])
+        return {
+            'started_at': self._started_at,
+            'elapsed': time.perf_counter() - self._origin,
+            'spans': spans
+        }
+
+    def save_report(self, path: str):
+        report = json.dumps(self.report(), indent=2, default=str)
+        files_tools.atomic_write(path, [report])
+        logger.debug("run report saved in %s" % path)
+
+
+tracer = Tracer()
+
+
+def profile_call(path: str, function: Callable, *args, **kwargs):
+    """Call function under cProfile and dump pstats file in path
+
+    Only the calling thread is profiled.
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        profiler.dump_stats(path)
+        logger.info("profile stats saved in %s" % path)
@@ -0,0 +1,89 @@
+import os
+import re
+import glob
+import json
+import logging
+import unicodedata
+from typing import Dict, List
+import mtpublishers.tools.files as files_tools
+
+logger = logging.getLogger(__name__)
+
+_VERSION = 2
+_TOKEN_SPLIT = re.compile(r'[^0-9a-z]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower case tokens of text, accents removed"""
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode().lower()
+    return [token for token in _TOKEN_SPLIT.split(text) if token]
+
+
+def shard_key(token: str, length: int) -> str:
+    return token[:length]
+
+
+def build_search_index(cat_items, shard_length: int = 1) -> Dict[str, dict]:
+    """Search index files of a category
+
+    Items are referenced by imdb_id. Documents (id, title, year, rating,
+    cover) of every item, in category order, let a browser render results
+    of the whole category, whatever page it shows. Title tokens postings
+    are split in shards on the first shard_length characters of the token:
+    a browser loads the shard of a query token and matches tokens by prefix
+    inside. Genre and language postings reuse category indexes.
+
+    Args:
+        cat_items (CategoryItems): category
+        shard_length (int, optional): token prefix length of shards. Defaults to 1.
+
+    Returns:
+        Dict[str, dict]: file name -> json content, manifest.json included
+    """
+    docs = []
+    shards = {}
+    for item in cat_items.unique_items:
+        imdb_id = item.get('imdb_id')
+        docs.append([imdb_id, item.get('title'), item.get('year'), item.get('rating'), item.get('cover_url')])
+        for token in set(tokenize(item.get('title'))):
+            shards.setdefault(shard_key(token, shard_length), {}).setdefault(token, []).append(imdb_id)
+
+    facets = {
+        'genres': {genre: _ids(items) for genre, items in sorted(cat_items.by_genre().items())},
+        'languages': {code: _ids(items) for code, items in sorted(cat_items.by_language().items())}
+    }
+
+    files = {'docs.json': docs, 'facets.json': facets}
+    for key, postings in shards.items():
+        files['t-%s.json' % key] = {token: postings[token] for token in sorted(postings)}
+    files['manifest.json'] = {
+        'version': _VERSION,
+        'count': len(docs),
+        'shard_length': shard_length,
+        'docs': 'docs.json',
+        'facets': 'facets.json',
+        'shards': {key: 't-%s.json' % key for key in sorted(shards)}
+    }
+    return files
+
+
+def _ids(items) -> List[str]:
+    return list(dict.fromkeys(item.get('imdb_id') for item in items if item.get('imdb_id')))
+
+
+def write_search_index(directory: str, files: Dict[str, dict]) -> int:
+    """Write index files in directory and remove those of a previous index
+
+    Returns:
+        int: number of files written (unchanged ones are not)
+    """
+    written = 0
+    for name, content in files.items():
+        written += files_tools.write_output(os.path.join(directory, name), [json.dumps(content, separators=(',', ':'))])
+    for index_file in glob.glob(os.path.join(directory, '*.json')):
+        if os.path.basename(index_file) not in files:
+            files_tools.remove_output(index_file)
+            logger.debug("stale search index file %s removed" % index_file)
+    return written
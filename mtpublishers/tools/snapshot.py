@@ -0,0 +1,77 @@
+import pickle
+import struct
+import logging
+from typing import Dict, List
+import mtpublishers.tools.files as files_tools
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b'MTSNAP'
+_VERSION = 1
+# magic, version, header length
+_PREFIX = struct.Struct('>6sHQ')
+
+
+def write_snapshot(path: str, fields: tuple, informations: dict, manifest: dict, categories: Dict[str, List[tuple]],
+                   failed: List[str] = None):
+    """Write a snapshot file
+
+    Layout: prefix (magic, version, header length), pickled header, then one
+    pickled blob of rows per category. Header holds offsets of blobs so a
+    reader loads only the categories it needs.
+
+    Args:
+        path (str): snapshot file
+        fields (tuple): field name of each row value
+        informations (dict): mediastrends informations
+        manifest (dict): category -> digest
+        categories (Dict[str, List[tuple]]): category -> rows
+        failed (List[str], optional): categories which couldn't be loaded. Defaults to None.
+    """
+    blobs = []
+    offsets = {}
+    offset = 0
+    for name, rows in categories.items():
+        blob = pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL)
+        offsets[name] = (offset, len(blob))
+        offset += len(blob)
+        blobs.append(blob)
+    header = pickle.dumps({
+        'fields': tuple(fields),
+        'informations': informations,
+        'manifest': manifest,
+        'categories': offsets,
+        'failed': list(failed) if failed else []
+    }, protocol=pickle.HIGHEST_PROTOCOL)
+    files_tools.atomic_write(path, [_PREFIX.pack(_MAGIC, _VERSION, len(header)), header] + blobs)
+    logger.debug("snapshot saved in %s (%d bytes)" % (path, _PREFIX.size + len(header) + offset))
+
+
+class SnapshotReader():
+    """Read a snapshot file, category rows are read on demand"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as snapshot:
+            magic, version, header_length = _PREFIX.unpack(snapshot.read(_PREFIX.size))
+            if magic != _MAGIC:
+                raise ValueError("%s is not a snapshot file" % path)
+            if version != _VERSION:
+                raise ValueError("Unsupported snapshot version %d (expected %d)" % (version, _VERSION))
+            header = pickle.loads(snapshot.read(header_length))
+        self._data_offset = _PREFIX.size + header_length
+        self.fields = header['fields']
+        self.informations = header['informations']
+        self.manifest = header['manifest']
+        self.failed = header.get('failed', [])
+        self._offsets = header['categories']
+
+    @property
+    def categories(self) -> List[str]:
+        return list(self._offsets)
+
+    def rows(self, category: str) -> List[tuple]:
+        offset, length = self._offsets[category]
+        with open(self.path, 'rb') as snapshot:
+            snapshot.seek(self._data_offset + offset)
+            return pickle.loads(snapshot.read(length))
@@ -1,56 +1,339 @@
 import os
+import re
+import glob
+import math
 import logging
+import tempfile
+import functools
 import jinja2
 import random
-from mtpublishers.core import Publisher
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+from mtpublishers.core import Publisher, CategoryItems, data_from_snapshot, process_pool_context
 from mtpublishers import config
+import mtpublishers.tools.files as files_tools
+import mtpublishers.tools.search as search_tools
+import mtpublishers.tools.assets as assets_tools
+from mtpublishers.tools.profiling import tracer
 
 logger = logging.getLogger(__name__)
 
 
+def _compiled_templates_fresh(compiled_dir: str, templates_dir: str) -> bool:
+    """True if precompiled templates are newer than every template source"""
+    if not compiled_dir or not os.path.isdir(compiled_dir):
+        return False
+    compiled_mtime = os.path.getmtime(compiled_dir)
+    for root, _, files in os.walk(templates_dir):
+        for name in files:
+            if os.path.getmtime(os.path.join(root, name)) > compiled_mtime:
+                logger.warning("Precompiled templates in %s are outdated: run compile-templates" % compiled_dir)
+                return False
+    return True
+
+
+@functools.lru_cache(maxsize=None)
+def jinja_environment() -> jinja2.Environment:
+    """Jinja environment shared by every publisher of the process
+
+    Templates come from [directory] jinja_compiled when these precompiled
+    templates are up to date, else from [directory] jinja. Bytecode of
+    compiled templates is persisted in [directory] jinja_cache, jinja
+    invalidates it when template source changes.
+    """
+    templates_dir = config.get('directory', 'jinja')
+    loader = jinja2.FileSystemLoader(templates_dir)
+
+    compiled_dir = config.get('directory', 'jinja_compiled', fallback='')
+    if _compiled_templates_fresh(compiled_dir, templates_dir):
+        loader = jinja2.ChoiceLoader([jinja2.ModuleLoader(compiled_dir), loader])
+
+    bytecode_cache = None
+    cache_dir = config.get('directory', 'jinja_cache', fallback='')
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(cache_dir)
+
+    return jinja2.Environment(loader=loader, bytecode_cache=bytecode_cache)
+
+
+def compile_templates(target: str = None):
+    """Precompile [directory] jinja templates into python modules
+
+    Args:
+        target (str, optional): output directory. Defaults to [directory] jinja_compiled.
+    """
+    target = target if target else config.get('directory', 'jinja_compiled', fallback='')
+    if not target:
+        raise ValueError("No target directory: set [directory] jinja_compiled")
+    env = jinja2.Environment(loader=jinja2.FileSystemLoader(config.get('directory', 'jinja')))
+    env.compile_templates(target, extensions=['html', 'svg'], zip=None, ignore_errors=False, log_function=logger.debug)
+    os.utime(target)
+    logger.info("templates compiled in %s" % target)
+
+
+def website_variants() -> List[str]:
+    """Variants of [website] variants, each one set in a [website.variant.NAME] section"""
+    return [name for name in re.split(r'[\s,]+', config.get('website', 'variants', fallback='')) if name]
+
+
+# data of the publisher rendering variants, inherited by forked pool processes
+# or loaded by _init_variant_process
+_variants_data = None
+
+
+def _init_variant_process(sections: dict, snapshot: str, changed_categories: list):
+    """Load config and data in a spawned pool process"""
+    global _variants_data
+    config.load_sections(sections)
+    _variants_data = data_from_snapshot(snapshot)
+    _variants_data.changed_categories = changed_categories
+
+
+def _publish_variant(variant: str) -> tuple:
+    """Render a variant in a pool process, data comes from the parent process memory
+
+    Returns:
+        tuple: (variant, success, spans recorded by this process, tracer origin of this process)
+    """
+    first_span = len(tracer.spans)
+    publisher = StaticWebsitePublisher(variant=variant)
+    publisher.data = _variants_data
+    success = publisher.publish()
+    return variant, success, tracer.spans[first_span:], tracer.origin
+
+
 class StaticWebsitePublisher(Publisher):
+    """Publish changed categories as html pages of [directory] website
+
+    Variants of [website] variants are rendered along with the main site in
+    pool processes, see publish_variants. A variant publisher reads its
+    settings in [website.variant.NAME] first, then in [website].
+    """
 
     _TEMPLATE_NAME = {'movies': 'index', 'series': 'series'}
 
-    def __init__(self, jinja_env: jinja2.Environment = None):
+    _RANDOM_CONTENT = {
+        'nav_item_actual': ['fresh', 'recent', 'actual', '2019 and +', 'what about a recent movie?'],
+        'nav_item_old': ['2018 and older', 'old', 'wanna see an old movie'],
+        'subtitle': [
+            'what people are watching lately',
+            'you will find what you\'re looking for',
+            'one more website to find movies',
+            'a great lockdown project'
+        ]
+    }
+
+    def __init__(self, jinja_env: jinja2.Environment = None, variant: str = None):
         super().__init__()
-        self._jinja_env = jinja_env if jinja_env else jinja2.Environment(loader=jinja2.FileSystemLoader(config.get('directory', 'jinja')))
+        self._jinja_env = jinja_env if jinja_env else jinja_environment()
         self._template = None
         self._output = None
+        self._variant = variant
+        self._section = 'website.variant.%s' % variant if variant else 'website'
+        if variant and not config.has_section(self._section):
+            raise ValueError("Website variant %s is not set: add a [%s] section" % (variant, self._section))
+        self._streaming = self.setting('streaming', config.getboolean, True)
+        self._recent_year = self.setting('recent_year', config.getint, 2019)
+        self._only_recent = self.setting('only_recent', config.getboolean, False)
+        self._page_size = self.setting('page_size', config.getint, 0)
+        self._search_index = self.setting('search_index', config.getboolean, True)
+        self._search_shard_length = self.setting('search_shard_length', config.getint, 1)
+        self._lang = self.setting('lang', config.get, 'en')
+        self._reproducible = config.getboolean('build', 'reproducible', fallback=False)
+        self._website_dir = config.get('directory', 'website')
+        if variant:
+            self._website_dir = os.path.join(self._website_dir, self.setting('directory', config.get, variant))
+
+    def setting(self, key: str, getter, fallback):
+        """Setting of the variant section, else of [website] section"""
+        return getter(self._section, key, fallback=getter('website', key, fallback=fallback))
 
     @property
     def output(self):
         return self._output
 
+    @property
+    def variant(self):
+        return self._variant
+
     def random_content(self, key: str):
-        random_content_values = {
-            'nav_item_actual': ['fresh', 'recent', 'actual', '2019 and +', 'what about a recent movie?'],
-            'nav_item_old': ['2018 and older', 'old', 'wanna see an old movie'],
-            'subtitle': [
-                'what people are watching lately',
-                'you will find what you\'re looking for',
-                'one more website to find movies',
-                'a great lockdown project'
-            ]
-        }
-        return random.choice(random_content_values.get(key))
+        """Random label, variants can set their own choices (one per line)
+
+        With [build] reproducible, choice is seeded with data hash: same
+        data, same pages.
+        """
+        values = self.setting(key, config.get, '')
+        values = [value.strip() for value in values.splitlines() if value.strip()] if values else self._RANDOM_CONTENT.get(key)
+        if self._reproducible:
+            return random.Random('%s:%s:%s' % (self.data.hash, self._variant or '', key)).choice(values)
+        return random.choice(values)
 
     def publish(self):
+        variants = website_variants() if not self._variant else []
+        if not variants:
+            return self.publish_pages()
+        return self.publish_variants(variants)
+
+    def publish_variants(self, variants: List[str]) -> bool:
+        """Render the main site here and variants in [website] variant_workers processes
+
+        Processes are forked when this process runs a single thread: they
+        share consolidated data, templates and jinja environment of this
+        process without serializing them. Forking while other threads run
+        (concurrent publishers) could copy a lock one of them holds, so
+        then processes are started fresh and load a snapshot of the data.
+        With one worker, variants are rendered one after another.
+        """
+        global _variants_data
+        workers = min(config.getint('website', 'variant_workers', fallback=0) or os.cpu_count() or 1, len(variants))
+        if workers <= 1:
+            success = self.publish_pages()
+            for variant in variants:
+                publisher = StaticWebsitePublisher(self._jinja_env, variant=variant)
+                publisher.data = self.data
+                success = publisher.publish() and success
+            return success
+
+        mp_context, fork = process_pool_context()
+        with tracer.span('variants', variants=variants, workers=workers, fork=fork) as span, \
+                tempfile.TemporaryDirectory(prefix='mediastrends-variants-') as tmp_dir:
+            pool_kwargs = {'mp_context': mp_context}
+            if not fork:
+                snapshot = os.path.join(tmp_dir, 'data.mts')
+                self.data.save_snapshot(snapshot)
+                pool_kwargs = {
+                    'mp_context': mp_context,
+                    'initializer': _init_variant_process,
+                    'initargs': (config.raw_sections(), snapshot, sorted(self.changed_categories))
+                }
+            _variants_data = self.data
+            try:
+                with ProcessPoolExecutor(max_workers=workers, **pool_kwargs) as executor:
+                    futures = [executor.submit(_publish_variant, variant) for variant in variants]
+                    success = self.publish_pages()
+                    for future in futures:
+                        try:
+                            variant, variant_success, spans, origin = future.result()
+                        except Exception as err:
+                            logger.error("Error while publishing website variant: %s" % err)
+                            success = False
+                            continue
+                        tracer.merge(spans, origin)
+                        if not variant_success:
+                            logger.error("website variant %s failed" % variant)
+                        success = success and variant_success
+            finally:
+                _variants_data = None
+            span['success'] = success
+        return success
+
+    def publish_pages(self) -> bool:
         try:
-            for cat_name, cat_items in self.data.category_items.items():
-                template_name = self._TEMPLATE_NAME[cat_name]
-                self.load_template(template_name)
-                self.render({
-                    'items': cat_items.items,
-                    'infos': self.data.informations,
-                    'nav_item_actual': self.random_content('nav_item_actual'),
-                    'nav_item_old': self.random_content('nav_item_old'),
-                    'subtitle': self.random_content('subtitle'),
-                    'max_valid_date': max([i.get('valid_date') for i in cat_items.items])
-                })
-                self.dump(template_name)
+            if config.getboolean('build', 'headers', fallback=True):
+                assets_tools.write_headers()
+            for cat_name in self.data.category_items:
+                if cat_name not in self.changed_categories:
+                    logger.debug("%s category didn't change: skip" % cat_name)
+                    continue
+                cat_items = self.data.category_items[cat_name]
+                template_name = self.template_name(cat_name)
+                with tracer.span('render:%s' % template_name, rows=len(cat_items.items), variant=self._variant) as span:
+                    self.load_template(template_name)
+                    span['changed'] = False
+                    span['bytes'] = 0
+                    pages = 0
+                    for page, vars in self.paginate(self.template_vars(cat_items), template_name):
+                        page_name = self.page_name(template_name, page)
+                        if self._streaming:
+                            changed = self.render_to_file(vars, page_name)
+                        else:
+                            self.render(vars)
+                            changed = self.dump(page_name)
+                        span['changed'] = span['changed'] or changed
+                        span['bytes'] += os.path.getsize(self.html_file(page_name))
+                        pages = page
+                    span['pages'] = pages
+                    self.remove_stale_pages(template_name, pages)
+                if self._search_index:
+                    self.write_search_index(cat_items)
         except Exception as err:
-            logger.error("Error while publishing one page website: %s" % str(err))
+            logger.error("Error while publishing one page website%s: %s" % (
+                ' (variant %s)' % self._variant if self._variant else '', str(err)))
+            return False
+        return True
+
+    def template_name(self, cat_name: str) -> str:
+        """Template of a category: [category.NAME] template, else default one"""
+        return config.get('category.%s' % cat_name, 'template', fallback=self._TEMPLATE_NAME.get(cat_name, cat_name))
+
+    def template_vars(self, cat_items: CategoryItems) -> dict:
+        items_actual, items_old = cat_items.split_by_year(self._recent_year)
+        if self._only_recent:
+            items_old = []
+        return {
+            'category': cat_items,
+            'lang': self._lang,
+            'variant': self._variant,
+            'items': cat_items.items,
+            'items_actual': items_actual,
+            'items_old': items_old,
+            'pagination': None,
+            'infos': self.data.informations,
+            'nav_item_actual': self.random_content('nav_item_actual'),
+            'nav_item_old': self.random_content('nav_item_old'),
+            'subtitle': self.random_content('subtitle'),
+            'max_valid_date': cat_items.max_valid_date,
+            'asset_url': assets_tools.asset_url_function(self._website_dir),
+            'search_index': '%s/manifest.json' % self.search_url(cat_items.category) if self._search_index else None
+        }
+
+    def search_url(self, cat_name: str) -> str:
+        return 'search/%s' % cat_name
+
+    def write_search_index(self, cat_items: CategoryItems):
+        """Write search index of a category in [directory] website/search/CATEGORY"""
+        with tracer.span('search:%s' % cat_items.category, rows=cat_items.count) as span:
+            files = search_tools.build_search_index(cat_items, self._search_shard_length)
+            directory = os.path.join(self._website_dir, self.search_url(cat_items.category))
+            span['files'] = len(files)
+            span['changed'] = search_tools.write_search_index(directory, files)
+
+    def paginate(self, vars: dict, template_name: str):
+        """Split template vars in pages of [website] page_size items per tab
+
+        Yields:
+            tuple: (page number starting at 1, vars of the page)
+        """
+        if self._page_size <= 0:
+            yield 1, vars
+            return
+        size = self._page_size
+        nb_pages = max(1, math.ceil(max(len(vars['items_actual']), len(vars['items_old'])) / size))
+        for page in range(1, nb_pages + 1):
+            page_vars = dict(vars)
+            page_vars['items_actual'] = vars['items_actual'][(page - 1) * size:page * size]
+            page_vars['items_old'] = vars['items_old'][(page - 1) * size:page * size]
+            page_vars['pagination'] = {
+                'page': page,
+                'pages': nb_pages,
+                'previous': '%s.html' % self.page_name(template_name, page - 1) if page > 1 else None,
+                'next': '%s.html' % self.page_name(template_name, page + 1) if page < nb_pages else None
+            }
+            yield page, page_vars
+
+    @staticmethod
+    def page_name(template_name: str, page: int) -> str:
+        return template_name if page <= 1 else '%s-%d' % (template_name, page)
+
+    def remove_stale_pages(self, template_name: str, nb_pages: int):
+        """Remove pages beyond nb_pages left by a previous publication"""
+        page_pattern = re.compile(r'^%s-(\d+)\.html$' % re.escape(template_name))
+        for html_file in glob.glob(os.path.join(self._website_dir, '%s-*.html' % template_name)):
+            match = page_pattern.match(os.path.basename(html_file))
+            if match and int(match.group(1)) > nb_pages:
+                files_tools.remove_output(html_file)
+                logger.debug("stale page %s removed" % html_file)
 
     def load_template(self, template_name: str):
         self._template = self._jinja_env.get_template("%s.html" % template_name)
@@ -58,7 +341,19 @@ class StaticWebsitePublisher(Publisher):
     def render(self, vars: dict):
         self._output = self._template.render(vars)
 
-    def dump(self, template_name: str):
-        html_file = os.path.join(config.get('directory', 'website'), '%s.html' % template_name)
-        with open(html_file, 'w') as website:
-            website.write(self._output)
+    def render_to_file(self, vars: dict, template_name: str) -> bool:
+        """Stream rendered template to its html file
+
+        Page is never held in memory, see files_tools.write_output.
+
+        Returns:
+            bool: True if html file changed
+        """
+        self._output = None
+        return files_tools.write_output(self.html_file(template_name), self._template.generate(vars))
+
+    def html_file(self, template_name: str) -> str:
+        return os.path.join(self._website_dir, '%s.html' % template_name)
+
+    def dump(self, template_name: str) -> bool:
+        return files_tools.write_output(self.html_file(template_name), [self._output])
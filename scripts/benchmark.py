@@ -0,0 +1,200 @@
+"""
+Benchmark publish pipeline stages on synthetic medias trends databases
+
+    python scripts/benchmark.py --sizes 1000 10000 100000 --output bench.json
+
+Each stage (data_from_sql, consolidate, create_hash, render, dump,
+render_to_file) is timed separately, results are written as json.
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import shutil
+import tempfile
+import statistics
+
+_GENRES = [
+    'Action', 'Adventure', 'Animation', 'Biography', 'Comedy', 'Crime', 'Documentary', 'Drama',
+    'Family', 'Fantasy', 'Film-Noir', 'History', 'Horror', 'Music', 'Musical', 'Mystery', 'News',
+    'Romance', 'Sci-Fi', 'Short', 'Sport', 'Thriller', 'War', 'Western'
+]
+_LANGUAGE_CODES = ['en', 'fr', 'es', 'de', 'it', 'ja', 'hi', 'ko', 'cmn', 'yue', 'pt', 'ru', 'da', 'el', 'zxx', 'haw']
+_WORDS = [
+    'night', 'return', 'last', 'king', 'war', 'love', 'dark', 'city', 'dead', 'girl', 'man', 'star',
+    'house', 'secret', 'blood', 'summer', 'story', 'lost', 'world', 'black', 'road', 'game', 'time'
+]
+
+_INFORMATIONS_SQL = "SELECT name, value FROM informations"
+_MOVIES_SQL = """SELECT title, imdb_id, rating, year, cover_url, score, valid_date, genres, language_codes
+FROM trending_movies ORDER BY score DESC"""
+
+_CONFIG = """[directory]
+base={root}
+sqlite={root}
+config={root}
+sql={root}/sql
+jinja={jinja}
+website={root}/website
+cache=
+jinja_cache=
+jinja_compiled=
+
+[sqlite]
+path=${{directory:sqlite}}/database.db
+
+[hash]
+file=${{directory:config}}/hash.txt
+
+[cache]
+queries=no
+"""
+
+
+def synthetic_database(path: str, size: int, seed: int = 0):
+    """Create a medias trends like sqlite database with size trending movies"""
+    rnd = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    con = sqlite3.connect(path)
+    con.execute("CREATE TABLE informations (name TEXT, value TEXT)")
+    con.execute("""CREATE TABLE trending_movies (
+        title TEXT, imdb_id TEXT, rating REAL, year INTEGER, cover_url TEXT,
+        score REAL, valid_date TEXT, genres TEXT, language_codes TEXT)""")
+    con.executemany("INSERT INTO informations VALUES (?, ?)", [
+        ('nb_torrent_movies', str(size * 7)),
+        ('nb_imdbobject_movies', str(size)),
+    ])
+
+    def rows():
+        for idx in range(size):
+            yield (
+                ' '.join(rnd.sample(_WORDS, rnd.randint(1, 4))).title(),
+                '%07d' % idx,
+                round(rnd.uniform(1, 9.5), 1) if rnd.random() > .05 else None,
+                rnd.randint(1950, 2020),
+                'https://m.media-amazon.com/images/M/%07d.jpg' % idx,
+                rnd.random(),
+                '2020-05-%02d %02d:00:00' % (rnd.randint(1, 28), rnd.randint(0, 23)),
+                ';'.join(rnd.sample(_GENRES, rnd.randint(1, 3))),
+                ';'.join(rnd.sample(_LANGUAGE_CODES, rnd.randint(1, 3)))
+            )
+
+    con.executemany("INSERT INTO trending_movies VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows())
+    con.commit()
+    con.close()
+
+
+def prepare_workdir(root: str, jinja_dir: str):
+    os.makedirs(os.path.join(root, 'sql'), exist_ok=True)
+    os.makedirs(os.path.join(root, 'website'), exist_ok=True)
+    with open(os.path.join(root, 'sql', 'mediastrends_informations.sql'), 'w') as sql_file:
+        sql_file.write(_INFORMATIONS_SQL)
+    with open(os.path.join(root, 'sql', 'trending_movies.sql'), 'w') as sql_file:
+        sql_file.write(_MOVIES_SQL)
+    with open(os.path.join(root, 'mediastrends.benchmark.ini'), 'w') as config_file:
+        config_file.write(_CONFIG.format(root=root, jinja=jinja_dir))
+
+
+def remove(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def bench_size(size: int, root: str, repeat: int) -> dict:
+    import mtpublishers.tools.data as data_tools
+    from mtpublishers.core import data_from_sql
+    from mtpublishers.website import StaticWebsitePublisher
+
+    synthetic_database(os.path.join(root, 'database.db'), size)
+    timings = {}
+
+    def record(stage, seconds):
+        timings.setdefault(stage, []).append(seconds)
+
+    output_bytes = 0
+    for _ in range(repeat):
+        seconds, data = timed(data_from_sql)
+        data_tools.close_shared_connection()
+        record('data_from_sql', seconds)
+
+        movies = data.get_movies()
+        record('consolidate', timed(movies.consolidate)[0])
+        record('create_hash', timed(lambda: (data.create_manifest(), data.create_hash()))[0])
+
+        publisher = StaticWebsitePublisher()
+        publisher.data = data
+        publisher.load_template('index')
+        template_vars = publisher.template_vars(movies)
+        record('render', timed(publisher.render, template_vars)[0])
+        output_bytes = len(publisher.output.encode())
+        remove(publisher.html_file('index'))
+        record('dump', timed(publisher.dump, 'index')[0])
+        remove(publisher.html_file('index'))
+        record('render_to_file', timed(publisher.render_to_file, template_vars, 'index')[0])
+
+    return {
+        'size': size,
+        'items': len(movies.items),
+        'output_bytes': output_bytes,
+        'stages': {
+            stage: {'min': min(runs), 'median': statistics.median(runs), 'runs': runs}
+            for stage, runs in timings.items()
+        }
+    }
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description="Benchmark mtpublishers publish pipeline")
+    parser.add_argument("--sizes", help="Number of trending movies", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", help="Runs per size", type=int, default=3)
+    parser.add_argument("--output", help="Json results file. Defaults to stdout", type=str)
+    parser.add_argument("--workdir", help="Keep databases and pages in this directory", type=str)
+    parser.add_argument("--jinja", help="Templates directory", type=str,
+                        default=os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'jinja'))
+    parsed_args = parser.parse_args(args)
+
+    root = os.path.abspath(parsed_args.workdir) if parsed_args.workdir else tempfile.mkdtemp(prefix='mtpublishers-bench-')
+    prepare_workdir(root, os.path.abspath(parsed_args.jinja))
+
+    # config is resolved on first access (LazyConfig), not on import:
+    # populate it explicitly with the benchmark config file
+    from mtpublishers import config
+    config.populate(user_dir_config=root, mode='benchmark')
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'repeat': parsed_args.repeat,
+        'results': []
+    }
+    try:
+        for size in parsed_args.sizes:
+            results['results'].append(bench_size(size, root, parsed_args.repeat))
+    finally:
+        if not parsed_args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if parsed_args.output:
+        with open(parsed_args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
+    exit()
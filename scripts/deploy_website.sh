@@ -2,31 +2,30 @@
 
 PROJECT_DIR=`pwd`
 WEBSITE_DIR=website
-WEBSITE_INDEX_PATH=$WEBSITE_DIR/index.html
 WEBSITE_BRANCH=website
 ORIGIN_REPO=github-ssh
 PYTHON=python3
+PUBLISHERS=website
 DATE_NOW=`date +%Y%m%d%H%M`
-WEBSITE_CHANGED=0
 
 echo "PROJECT_DIR:        $PROJECT_DIR"
 echo "WEBSITE_DIR:        $WEBSITE_DIR"
-echo "WEBSITE_INDEX_PATH: $WEBSITE_INDEX_PATH"
 echo "WEBSITE_BRANCH:     $WEBSITE_BRANCH"
 echo "ORIGIN_REPO:        $ORIGIN_REPO"
+echo "PUBLISHERS:         $PUBLISHERS"
 echo "DATE_NOW:           $DATE_NOW"
 
 git checkout $WEBSITE_BRANCH
 # uncomment if needed
 # git pull $ORIGIN_REPO master
 
-$PYTHON -m mtpublishers.cli publish -p website
+$PYTHON -m mtpublishers.cli publish -p $PUBLISHERS
 
-git diff --name-only --exit-code | grep -q $WEBSITE_INDEX_PATH
-
-if [ $? -eq 0 ]; then
+# whole output: pages, hashed assets, search index, feeds, cards and
+# precompressed siblings, new and removed files included
+if [ -n "`git status --porcelain --untracked-files=all -- $WEBSITE_DIR`" ]; then
     echo "Info: Website is updated"
-    git add $WEBSITE_INDEX_PATH
+    git add -A -- $WEBSITE_DIR
     git commit -m"Website: update $DATE_NOW"
     echo "Info: Deploying website..."
     git push $ORIGIN_REPO $WEBSITE_BRANCH
@@ -34,4 +33,4 @@ else
     echo "Info: Website is not updated"
 fi
 
-echo "Info: Done."
\ No newline at end of file
+echo "Info: Done."
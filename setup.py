@@ -14,6 +14,9 @@ setup(
     include_package_data=True,
     platforms=['any'],
     install_requires=requirements,
+    extras_require={
+        'brotli': ['brotli>=1.0']
+    },
     url="https://github.com/prise6/medias-trends-publishers",
     description='Publish trends of medias torrents',
     long_description=long_description,
@@ -21,5 +24,8 @@ setup(
     author='prise6',
     author_email="vieille.francois@gmail.com",
     license='GNU GPLv3',
-    python_requires='>=3.5'
+    python_requires='>=3.5',
+    entry_points={
+        'console_scripts': ['mediastrends=mtpublishers.cli:main']
+    }
 )
@@ -0,0 +1,177 @@
+import os
+import json
+import tempfile
+import threading
+import unittest
+from mtpublishers import config
+from mtpublishers.core import CategoryItems, MediasTrendsData, Publisher, PublishResult, STILL_RUNNING, run_updates, \
+    _merge_informations
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_data(movies_title: str = 'title_1', series_title: str = 'serie_1', failed: set = None) -> MediasTrendsData:
+    data = MediasTrendsData()
+    data.category_items = [
+        CategoryItems('movies', [{'title': movies_title, 'imdb_id': '1234', 'rating': 7.2}]),
+        CategoryItems('series', [{'title': series_title, 'imdb_id': '4321', 'rating': 8.1}])
+    ]
+    if failed:
+        data.failed_categories = failed
+    return data
+
+
+class ChangedCategoriesPublisher(Publisher):
+    """Keep categories each update was asked to publish"""
+
+    def __init__(self):
+        super().__init__()
+        self.published = []
+
+    def publish(self):
+        self.published.append(set(self.changed_categories))
+        return True
+
+
+class MergeInformationsTest(unittest.TestCase):
+
+    def test_numbers_are_summed(self):
+        merged = _merge_informations([{'movies': 9, 'ratio': 0.5}, {'movies': 10, 'ratio': 1.25}])
+
+        self.assertEqual(merged, {'movies': 19, 'ratio': 1.75})
+
+    def test_numeric_text_is_summed(self):
+        merged = _merge_informations([{'movies': '9', 'ratio': '0.5'}, {'movies': '10', 'ratio': 1}, {'movies': 1}])
+
+        self.assertEqual(merged, {'movies': 20, 'ratio': 1.5})
+
+    def test_dates_are_the_greatest(self):
+        merged = _merge_informations([{'date': '2021-03-09 10:00:00'}, {'date': '2021-03-10 08:00:00'},
+                                      {'date': '2021-02-28 23:00:00'}])
+
+        self.assertEqual(merged, {'date': '2021-03-10 08:00:00'})
+
+    def test_missing_values(self):
+        merged = _merge_informations([{'movies': None, 'date': '2021-03-09'}, {'movies': '3', 'series': 2}, {'date': None}])
+
+        self.assertEqual(merged, {'movies': '3', 'date': '2021-03-09', 'series': 2})
+
+
+class ManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.hash_file = os.path.join(self.tmp_dir.name, 'hash.txt')
+        with open(os.path.join(self.tmp_dir.name, 'mediastrends.test.ini'), 'w') as ini:
+            ini.write("[directory]\nbase=%s\n\n[hash]\nfile=%s\n" % (PACKAGE_DIR, self.hash_file))
+        config.populate(user_dir_config=self.tmp_dir.name, mode='test')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def saved(self) -> dict:
+        with open(self.hash_file, 'r') as hash_file:
+            return json.load(hash_file)
+
+    def publish(self, data: MediasTrendsData) -> set:
+        publisher = ChangedCategoriesPublisher()
+        data.register_observer(publisher)
+        results = data.notify()
+        return publisher.published[0] if results else None
+
+    def test_first_publication(self):
+        data = make_data()
+
+        self.assertEqual(data.changed_categories, {'movies', 'series'})
+        self.assertFalse(data.hash_exists)
+        self.assertEqual(self.publish(data), {'movies', 'series'})
+        self.assertEqual(self.saved(), {'hash': data.hash, 'categories': data.manifest})
+
+    def test_only_changed_categories(self):
+        self.publish(make_data())
+
+        unchanged = make_data()
+        self.assertEqual(unchanged.changed_categories, set())
+        self.assertTrue(unchanged.hash_exists)
+        self.assertIsNone(self.publish(unchanged))
+
+        changed = make_data(series_title='serie_2')
+        self.assertEqual(changed.changed_categories, {'series'})
+        self.assertFalse(changed.hash_exists)
+        self.assertEqual(self.publish(changed), {'series'})
+        self.assertTrue(make_data(series_title='serie_2').hash_exists)
+
+    def test_legacy_hash_file_is_upgraded(self):
+        with open(self.hash_file, 'w') as hash_file:
+            hash_file.write('0123456789abcdef0123456789abcdef')
+
+        data = make_data()
+        self.assertEqual(data.open_hash(), '0123456789abcdef0123456789abcdef')
+        self.assertEqual(data.open_manifest(), {})
+        self.assertEqual(data.changed_categories, {'movies', 'series'})
+        self.assertFalse(data.hash_exists)
+
+        self.assertEqual(self.publish(data), {'movies', 'series'})
+        self.assertEqual(self.saved()['categories'], data.manifest)
+        self.assertTrue(make_data().hash_exists)
+
+    def test_failed_category_is_never_published(self):
+        self.publish(make_data())
+        published = self.saved()
+
+        data = make_data(movies_title='title_2', series_title='serie_2', failed={'movies'})
+        self.assertEqual(data.changed_categories, {'series'})
+        self.assertEqual(self.publish(data), {'series'})
+        saved = self.saved()
+        self.assertEqual(saved['categories']['movies'], published['categories']['movies'])
+        self.assertEqual(saved['categories']['series'], data.manifest['series'])
+        self.assertNotEqual(saved['hash'], data.hash)
+
+        recovered = make_data(movies_title='title_2', series_title='serie_2')
+        self.assertEqual(recovered.changed_categories, {'movies'})
+        recovered.clear_hash()
+        self.assertEqual(recovered.changed_categories, {'movies', 'series'})
+
+    def test_failed_category_without_publication(self):
+        data = make_data(failed={'series'})
+        self.assertEqual(self.publish(data), {'movies'})
+        self.assertEqual(set(self.saved()['categories']), {'movies'})
+
+        data = make_data(failed={'series'})
+        self.assertTrue(data.hash_exists)
+        data.clear_hash()
+        self.assertEqual(data.changed_categories, {'movies'})
+
+        self.assertEqual(make_data().changed_categories, {'series'})
+
+
+class RunUpdatesTest(unittest.TestCase):
+
+    def test_timed_out_observer_is_skipped_until_it_returns(self):
+        observer = 'slow'
+        release = threading.Event()
+        calls = []
+
+        def update():
+            calls.append(observer)
+            release.wait(5)
+            return PublishResult(observer, True, 0, None)
+
+        timed_out = run_updates([(observer, update)], timeout=0.05)
+        self.assertEqual([result.error for result in timed_out], ['timeout after 0.05s'])
+
+        skipped = run_updates([(observer, update), ('other', lambda: PublishResult('other', True, 0, None))], workers=2)
+        self.assertEqual([(result.success, result.error) for result in skipped], [(False, STILL_RUNNING), (True, None)])
+        self.assertEqual(calls, [observer])
+
+        release.set()
+        for _ in range(100):
+            done = run_updates([(observer, lambda: PublishResult(observer, True, 0, None))])
+            if done[0].success:
+                break
+            threading.Event().wait(0.01)
+        self.assertTrue(done[0].success)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import time
+import tempfile
+import unittest
+import threading
+import functools
+import http.server
+from mtpublishers.tools.covers import HTTPCoverFetcher
+
+
+class FixturesHandler(http.server.SimpleHTTPRequestHandler):
+    """Serve fixtures directory, requests are kept by the server"""
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get('If-Modified-Since')))
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        return
+
+
+class HTTPCoverFetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.fixtures = os.path.join(self.tmp_dir.name, 'fixtures')
+        self.cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+        os.makedirs(self.fixtures)
+        self.write_fixture('cover.jpg', b'first cover', mtime=time.time() - 3600)
+
+        handler = functools.partial(FixturesHandler, directory=self.fixtures)
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/cover.jpg' % self.server.server_address[1]
+        self.fetcher = HTTPCoverFetcher(cache_dir=self.cache_dir, max_age=60, timeout=5)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def write_fixture(self, name: str, content: bytes, mtime: float):
+        path = os.path.join(self.fixtures, name)
+        with open(path, 'wb') as fixture:
+            fixture.write(content)
+        os.utime(path, (mtime, mtime))
+
+    def expire_cache(self):
+        old = time.time() - 120
+        os.utime(self.fetcher.cache_file(self.url), (old, old))
+
+    def test_cover_is_cached(self):
+        self.assertEqual(self.fetcher.fetch(self.url), b'first cover')
+        self.assertEqual(self.fetcher.fetch(self.url), b'first cover')
+
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertTrue(os.path.exists(self.fetcher.cache_file(self.url)))
+
+    def test_expired_cover_not_modified(self):
+        self.fetcher.fetch(self.url)
+        self.expire_cache()
+
+        self.assertEqual(self.fetcher.fetch(self.url), b'first cover')
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertIsNotNone(self.server.requests[1][1])
+        self.assertLess(time.time() - os.path.getmtime(self.fetcher.cache_file(self.url)), 60)
+
+        self.fetcher.fetch(self.url)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_expired_cover_modified(self):
+        self.fetcher.fetch(self.url)
+        self.write_fixture('cover.jpg', b'second cover', mtime=time.time())
+        self.expire_cache()
+
+        self.assertEqual(self.fetcher.fetch(self.url), b'second cover')
+        with open(self.fetcher.cache_file(self.url), 'rb') as cached:
+            self.assertEqual(cached.read(), b'second cover')
+
+    def test_missing_cover_is_not_cached(self):
+        url = self.url.replace('cover.jpg', 'missing.jpg')
+
+        self.assertIsNone(self.fetcher.fetch(url))
+        self.assertIsNone(self.fetcher.fetch(url))
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertFalse(os.path.exists(self.fetcher.cache_file(url)))
+
+
+if __name__ == '__main__':
+    unittest.main()
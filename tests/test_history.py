@@ -0,0 +1,175 @@
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import unittest
+from mtpublishers.tools.history import ArchiveStore, _empty_state, _RECORD, order_delta, apply_order_delta
+
+FIELDS = ('title', 'rating')
+
+
+def snapshots(count: int, seed: int = 7) -> list:
+    """Successive categories of count snapshots: items come, go, move and change"""
+    rng = random.Random(seed)
+    movies = {'tt%03d' % i: ('title %d' % i, 5.0) for i in range(30)}
+    series = {'tt%03d' % i: ('serie %d' % i, 7.0) for i in range(100, 110)}
+    next_id = 200
+    result = []
+    for _ in range(count):
+        keys = list(movies)
+        for key in rng.sample(keys, 3):
+            del movies[key]
+        for _ in range(4):
+            movies['tt%03d' % next_id] = ('title %d' % next_id, 6.0)
+            next_id += 1
+        for key in rng.sample(list(movies), 2):
+            movies[key] = (movies[key][0], round(rng.uniform(1, 9), 1))
+        order = list(movies)
+        head = order[:10]
+        rng.shuffle(head)
+        order[:10] = head
+        order[3:8] = reversed(order[3:8])
+        movies = {key: movies[key] for key in order}
+        result.append({'movies': dict(movies), 'series': dict(series)})
+    return result
+
+
+class OrderDeltaTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        rng = random.Random(3)
+        previous = ['k%d' % i for i in range(50)]
+        cases = [previous[:], previous[1:], previous[::-1], ['new'] + previous[:25] + ['other'] + previous[30:], []]
+        for _ in range(20):
+            order = [key for key in previous if rng.random() > 0.2] + ['n%d' % rng.randint(0, 99)]
+            position = rng.randint(0, len(order) - 1)
+            order.insert(position, order.pop(0))
+            cases.append(list(dict.fromkeys(order)))
+        for order in cases:
+            self.assertEqual(apply_order_delta(previous, order_delta(previous, order)), order)
+
+    def test_close_order_is_slices(self):
+        previous = ['k%d' % i for i in range(50)]
+        order = previous[:20] + ['new'] + previous[20:]
+
+        self.assertEqual(order_delta(previous, order), [(0, 20), ['new'], (20, 50)])
+
+
+class ArchiveStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'archive.store')
+        self.snapshots = snapshots(6)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def append_all(self, store: ArchiveStore, categories_list: list = None):
+        for position, categories in enumerate(categories_list if categories_list else self.snapshots):
+            store.append({'name': 'day-%d' % position, 'hash': 'hash-%d' % position}, {'count': position}, categories)
+
+    def assertState(self, store: ArchiveStore, categories: dict):
+        self.assertEqual(set(store.state['categories']), set(categories))
+        for cat_name, items in categories.items():
+            self.assertEqual(store.state['categories'][cat_name]['order'], list(items))
+            self.assertEqual(store.state['categories'][cat_name]['items'], items)
+            self.assertEqual(store.items(cat_name), [dict(zip(FIELDS, values)) for values in items.values()])
+
+    def test_records_hold_changes_only(self):
+        store = ArchiveStore(self.path, FIELDS)
+        self.append_all(store)
+
+        records = list(store.records())
+        self.assertEqual(len(records), len(self.snapshots))
+        self.assertEqual(len(records[0]['categories']['movies']['changed']), len(self.snapshots[0]['movies']))
+        for position, record in enumerate(records[1:], 1):
+            delta = record['categories']['movies']
+            self.assertEqual(len(delta['removed']), 3)
+            self.assertLessEqual(len(delta['changed']), 6)
+            self.assertTrue(any(isinstance(operation, tuple) for operation in delta['order']))
+            self.assertNotIn('series', record['categories'])
+            self.assertEqual(record['informations'], {'count': position})
+        self.assertEqual([snapshot['name'] for snapshot in store.snapshots], ['day-%d' % i for i in range(6)])
+
+    def test_replay_every_snapshot(self):
+        self.append_all(ArchiveStore(self.path, FIELDS))
+
+        state = _empty_state(FIELDS)
+        store = ArchiveStore(self.path, FIELDS)
+        for record, categories in zip(store.records(), self.snapshots):
+            store._apply(state, record)
+            for cat_name, items in categories.items():
+                self.assertEqual(state['categories'][cat_name]['order'], list(items))
+                self.assertEqual(state['categories'][cat_name]['items'], items)
+        self.assertEqual(state['informations'], {'count': 5})
+
+    def test_reload_with_and_without_checkpoint(self):
+        self.append_all(ArchiveStore(self.path, FIELDS))
+
+        from_checkpoint = ArchiveStore(self.path, FIELDS)
+        self.assertState(from_checkpoint, self.snapshots[-1])
+
+        os.remove(from_checkpoint.checkpoint_file)
+        replayed = ArchiveStore(self.path, FIELDS)
+        self.assertState(replayed, self.snapshots[-1])
+        self.assertEqual(replayed.state, from_checkpoint.state)
+        self.assertTrue(os.path.exists(replayed.checkpoint_file))
+
+    def test_outdated_checkpoint_is_rebuilt(self):
+        store = ArchiveStore(self.path, FIELDS)
+        self.append_all(store, self.snapshots[:3])
+        old_checkpoint = os.path.join(self.tmp_dir.name, 'old.checkpoint')
+        shutil.copy(store.checkpoint_file, old_checkpoint)
+        self.append_all(store, self.snapshots[3:])
+        shutil.copy(old_checkpoint, store.checkpoint_file)
+
+        store = ArchiveStore(self.path, FIELDS)
+        self.assertState(store, self.snapshots[-1])
+        self.assertEqual(len(store.snapshots), 3 + len(self.snapshots[3:]))
+
+    def test_truncated_record_is_dropped(self):
+        store = ArchiveStore(self.path, FIELDS)
+        self.append_all(store, self.snapshots[:2])
+        size = store.size()
+        with open(self.path, 'ab') as store_file:
+            store_file.write(_RECORD.pack(1000) + b'partial')
+        os.remove(store.checkpoint_file)
+
+        store = ArchiveStore(self.path, FIELDS)
+        self.assertState(store, self.snapshots[1])
+        store.append({'name': 'day-2', 'hash': 'hash-2'}, {}, self.snapshots[2])
+        self.assertEqual(len(list(store.records())), 3)
+        self.assertGreater(store.size(), size)
+        self.assertState(ArchiveStore(self.path, FIELDS), self.snapshots[2])
+
+    def test_dropped_category(self):
+        store = ArchiveStore(self.path, FIELDS)
+        self.append_all(store, self.snapshots[:2])
+        store.append({'name': 'day-2', 'hash': 'hash-2'}, {}, {'movies': self.snapshots[2]['movies']})
+
+        os.remove(store.checkpoint_file)
+        self.assertState(ArchiveStore(self.path, FIELDS), {'movies': self.snapshots[2]['movies']})
+
+    def test_version_1_records_and_other_fields(self):
+        items = {'tt1': ('title 1', 2020, 5.0), 'tt2': ('title 2', 2021, 6.0)}
+        record = {
+            'fields': ('title', 'year', 'rating'),
+            'snapshot': {'name': 'day-0', 'hash': 'hash-0', 'items': 2, 'changed': 2},
+            'informations': {},
+            'categories': {'movies': {'changed': items, 'removed': [], 'order': ['tt2', 'tt1']}}
+        }
+        payload = pickle.dumps(record)
+        with open(self.path, 'wb') as store_file:
+            store_file.write(_RECORD.pack(len(payload)) + payload)
+
+        store = ArchiveStore(self.path, FIELDS)
+        self.assertState(store, {'movies': {'tt2': ('title 2', 6.0), 'tt1': ('title 1', 5.0)}})
+        store.append({'name': 'day-1', 'hash': 'hash-1'}, {}, {'movies': {'tt1': ('title 1', 5.0), 'tt3': ('title 3', 4.0)}})
+        os.remove(store.checkpoint_file)
+        self.assertState(ArchiveStore(self.path, FIELDS), {'movies': {'tt1': ('title 1', 5.0), 'tt3': ('title 3', 4.0)}})
+
+
+if __name__ == '__main__':
+    unittest.main()
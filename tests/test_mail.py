@@ -0,0 +1,140 @@
+import os
+import email
+import tempfile
+import threading
+import unittest
+import socketserver
+from email import policy
+from mtpublishers import config
+from mtpublishers.core import data_from_static_gen
+from mtpublishers.mail import EmailPublisher, to_header
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: every accepted message is kept by the server"""
+
+    def reply(self, line: str):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 stand-in ready')
+        sender, recipients = None, []
+        for line in self.rfile:
+            line = line.decode().rstrip('\r\n')
+            verb = line[:4].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 stand-in')
+            elif verb == 'MAIL':
+                sender, recipients = line.split(':', 1)[1].strip().strip('<>'), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipient = line.split(':', 1)[1].strip().strip('<>')
+                if recipient in self.server.refused:
+                    self.reply('550 no such user')
+                else:
+                    recipients.append(recipient)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 end data with <CR><LF>.<CR><LF>')
+                lines = []
+                for data_line in self.rfile:
+                    if data_line == b'.\r\n':
+                        break
+                    lines.append(data_line[1:] if data_line.startswith(b'..') else data_line)
+                self.server.messages.append((sender, recipients, b''.join(lines)))
+                self.reply('250 OK')
+            elif verb in ('RSET', 'NOOP'):
+                sender, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('502 not implemented')
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, refused: set = None):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.refused = refused if refused else set()
+        self.messages = []
+        self.connections = 0
+
+
+class EmailPublisherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.tmp_dir.name, 'mediastrends.test.ini'), 'w') as ini:
+            ini.write("[directory]\nbase=%s\n\n[hash]\nfile=%s\n" % (PACKAGE_DIR, os.path.join(self.tmp_dir.name, 'hash.txt')))
+        config.populate(user_dir_config=self.tmp_dir.name, mode='test')
+
+        self.server = SMTPStandIn(refused={'refused@example.com'})
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+        config.set('email', 'host', '127.0.0.1')
+        config.set('email', 'port', str(self.server.server_address[1]))
+        config.set('email', 'sender', 'mediastrends@example.com')
+        config.set('email', 'connections', '1')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def publish(self, recipients: str) -> EmailPublisher:
+        config.set('email', 'recipients', recipients)
+        publisher = EmailPublisher()
+        self.success = publisher.update(data_from_static_gen())
+        return publisher
+
+    def test_sends_multipart_digest(self):
+        publisher = self.publish('alice@example.com, zoe@example.com')
+
+        self.assertTrue(self.success)
+        self.assertEqual(publisher.failures, {})
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual([recipients for _, recipients, _ in self.server.messages],
+                         [['alice@example.com'], ['zoe@example.com']])
+
+        sender, _, raw = self.server.messages[1]
+        message = email.message_from_bytes(raw, policy=policy.default)
+        self.assertEqual(sender, 'mediastrends@example.com')
+        self.assertEqual(str(message['To']), 'zoe@example.com')
+        self.assertEqual(message.get_content_type(), 'multipart/alternative')
+        self.assertEqual([part.get_content_type() for part in message.iter_parts()], ['text/plain', 'text/html'])
+        self.assertIn('title_2', message.get_body(('plain',)).get_content())
+        self.assertIn('Popular movies', message.get_body(('html',)).get_content())
+
+    def test_refused_recipients_are_reported(self):
+        publisher = self.publish('alice@example.com refused@example.com')
+
+        self.assertTrue(self.success)
+        self.assertEqual(list(publisher.failures), ['refused@example.com'])
+        self.assertEqual(len(self.server.messages), 1)
+
+    def test_fails_when_no_recipient_got_it(self):
+        publisher = self.publish('refused@example.com')
+
+        self.assertFalse(self.success)
+        self.assertEqual(list(publisher.failures), ['refused@example.com'])
+
+    def test_to_header(self):
+        header, address = to_header('Zoé <zoe@example.com>')
+
+        self.assertEqual(address, 'zoe@example.com')
+        self.assertEqual(header, b'To: =?utf-8?q?Zo=C3=A9?= <zoe@example.com>\r\n')
+
+    def test_header_injection_is_refused(self):
+        with self.assertRaises(ValueError):
+            to_header('alice@example.com\r\nBcc: mallory@example.com')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import tempfile
+import unittest
+from mtpublishers import config
+from mtpublishers.core import Publisher, data_from_static_gen, data_from_snapshot
+from mtpublishers.tasks import retry_outbox
+from mtpublishers.tools.outbox import Outbox
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class RecordingPublisher(Publisher):
+    """Publisher succeeding when its class says so, published data hashes are kept"""
+
+    success = True
+    published = []
+
+    def publish(self):
+        RecordingPublisher.published.append((self.data.hash, sorted(self.changed_categories)))
+        return RecordingPublisher.success
+
+
+class OtherPublisher(RecordingPublisher):
+    pass
+
+
+class OutboxTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.hash_file = os.path.join(self.tmp_dir.name, 'hash.txt')
+        with open(os.path.join(self.tmp_dir.name, 'mediastrends.test.ini'), 'w') as ini:
+            ini.write("[directory]\nbase=%s\n\n[hash]\nfile=%s\n" % (PACKAGE_DIR, self.hash_file))
+        config.populate(user_dir_config=self.tmp_dir.name, mode='test')
+        self.outbox = Outbox(os.path.join(self.tmp_dir.name, 'outbox.db'), max_attempts=3, backoff=60)
+        self.publisher = Outbox.publisher_id(RecordingPublisher())
+        self.other = Outbox.publisher_id(OtherPublisher())
+        RecordingPublisher.success = True
+        RecordingPublisher.published = []
+
+    def tearDown(self):
+        self.outbox.close()
+        self.tmp_dir.cleanup()
+
+    def save_payload(self, data) -> str:
+        payload = self.outbox.payload_file(data.hash)
+        data.save_snapshot(payload)
+        return payload
+
+    def make_due(self):
+        with self.outbox._connection:
+            self.outbox._connection.execute("UPDATE jobs SET next_attempt = 0 WHERE status = ?", (Outbox.PENDING,))
+
+    def test_failures_back_off_until_failed(self):
+        for attempt in range(1, 3):
+            before = time.time()
+            self.outbox.record('hash_1', self.publisher, False, error='boom')
+            job = self.outbox.jobs('hash_1')[self.publisher]
+            self.assertEqual((job['status'], job['attempts'], job['last_error']), (Outbox.PENDING, attempt, 'boom'))
+            delay = 60 * 2 ** (attempt - 1)
+            self.assertGreaterEqual(job['next_attempt'], before + delay)
+            self.assertLessEqual(job['next_attempt'], time.time() + delay)
+        self.assertEqual(self.outbox.due_jobs(), [])
+        self.assertEqual(len(self.outbox.due_jobs(now=time.time() + 120)), 1)
+
+        self.outbox.record('hash_1', self.publisher, False, error='boom')
+        job = self.outbox.jobs('hash_1')[self.publisher]
+        self.assertEqual((job['status'], job['attempts'], job['next_attempt']), (Outbox.FAILED, 3, None))
+        self.assertEqual(self.outbox.due_jobs(now=time.time() + 3600), [])
+
+    def test_success_is_done_and_supersedes_older_data(self):
+        self.outbox.record('hash_1', self.publisher, False, payload='payload_1')
+        self.outbox.record('hash_1', self.other, False, payload='payload_1')
+        self.outbox.record('hash_2', self.publisher, True)
+
+        self.assertEqual(self.outbox.jobs('hash_1')[self.publisher]['status'], Outbox.SUPERSEDED)
+        self.assertEqual(self.outbox.jobs('hash_1')[self.other]['status'], Outbox.PENDING)
+        self.assertEqual(self.outbox.jobs('hash_2')[self.publisher]['status'], Outbox.DONE)
+        self.assertTrue(self.outbox.all_done('hash_2'))
+        self.assertFalse(self.outbox.all_done('hash_2', [self.publisher, self.other]))
+        self.assertEqual(self.outbox.latest_hash(), 'hash_2')
+
+    def test_retry_keeps_payload_and_categories(self):
+        self.outbox.record('hash_1', self.publisher, False, payload='payload_1', categories=['series', 'movies'])
+        self.outbox.record('hash_1', self.publisher, False, error='again')
+
+        job = self.outbox.jobs('hash_1')[self.publisher]
+        self.assertEqual((job['payload'], json.loads(job['categories'])), ('payload_1', ['movies', 'series']))
+
+    def test_due_jobs_only_latest_data_per_publisher(self):
+        self.outbox.record('hash_1', self.publisher, False)
+        time.sleep(0.01)
+        self.outbox.record('hash_2', self.publisher, False)
+        self.make_due()
+
+        self.assertEqual([job['data_hash'] for job in self.outbox.due_jobs()], ['hash_2'])
+
+    def test_payload_round_trip(self):
+        data = data_from_static_gen()
+        data.add_information('date', '2021-03-10 08:00:00')
+        loaded = data_from_snapshot(self.save_payload(data))
+
+        self.assertEqual(loaded.hash, data.hash)
+        self.assertEqual(loaded.informations, data.informations)
+        self.assertEqual([item.get('title') for item in loaded.category_items['movies'].items],
+                         [item.get('title') for item in data.category_items['movies'].items])
+
+    def test_prune_payloads(self):
+        data = data_from_static_gen()
+        payload = self.save_payload(data)
+        stale = self.outbox.payload_file('stale')
+        with open(stale, 'wb') as stale_payload:
+            stale_payload.write(b'')
+        self.outbox.record(data.hash, self.publisher, False, payload=payload)
+
+        self.outbox.prune_payloads()
+        self.assertTrue(os.path.exists(payload))
+        self.assertFalse(os.path.exists(stale))
+
+        self.outbox.record(data.hash, self.publisher, True)
+        self.outbox.prune_payloads()
+        self.assertFalse(os.path.exists(payload))
+
+    def test_retry_outbox_saves_hash_once_done(self):
+        data = data_from_static_gen()
+        payload = self.save_payload(data)
+        for publisher in (self.publisher, self.other):
+            self.outbox.record(data.hash, publisher, False, payload=payload, categories=['movies'])
+        self.make_due()
+
+        RecordingPublisher.success = False
+        results = retry_outbox(self.outbox, skip=[self.other], workers=1)
+        self.assertEqual([result.success for result in results], [False])
+        self.assertEqual(self.outbox.jobs(data.hash)[self.publisher]['attempts'], 2)
+        self.assertFalse(os.path.exists(self.hash_file))
+
+        self.make_due()
+        RecordingPublisher.success = True
+        results = retry_outbox(self.outbox, workers=2, timeout=5)
+        self.assertEqual([result.success for result in results], [True, True])
+        self.assertEqual(RecordingPublisher.published[-1], (data.hash, ['movies']))
+        self.assertTrue(self.outbox.all_done(data.hash))
+        with open(self.hash_file, 'r') as hash_file:
+            self.assertEqual(json.load(hash_file)['hash'], data.hash)
+
+    def test_retry_without_payload_fails(self):
+        self.outbox.record('hash_1', self.publisher, False, payload=self.outbox.payload_file('hash_1'))
+        self.make_due()
+
+        results = retry_outbox(self.outbox, workers=1)
+        self.assertFalse(results[0].success)
+        self.assertIn('payload', results[0].error)
+        self.assertEqual(RecordingPublisher.published, [])
+
+
+if __name__ == '__main__':
+    unittest.main()